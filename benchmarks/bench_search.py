@@ -0,0 +1,130 @@
+"""
+Benchmark for serverFiles/Search_Index.py
+
+Generates a synthetic company folder of trade-log style files, then measures
+- full index build time
+- incremental update / move / delete time
+- query latency (p50 / p95 / p99) for single and multi-term queries
+
+run from the repo root:
+    python benchmarks/bench_search.py                 # 100k files
+    python benchmarks/bench_search.py --files 5000    # quick run
+"""
+
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from serverFiles.Search_Index import SearchIndexManager  # noqa: E402
+
+TICKERS = ["AAPL", "MSFT", "BRK.B", "JPM", "GS", "TSLA", "NVDA", "XOM", "BAC", "C",
+           "AMZN", "META", "GOOGL", "V", "MA", "WFC", "MS", "BLK", "SCHW", "AXP"]
+PAIRS = ["EUR/USD", "GBP/USD", "USD/JPY", "AUD/USD", "USD/CHF"]
+COUNTERPARTIES = ["Citadel", "Jane Street", "J.P.Morgan", "Goldman Sachs", "Barclays",
+                  "Deutsche Bank", "BNP Paribas", "Virtu", "Susquehanna", "AT&T Pension"]
+SIDES = ["Buy", "Sell"]
+
+
+def fake_line(rng):
+    if rng.random() < 0.2:
+        return f"{rng.choice(SIDES)} {rng.randint(1, 50) * 100_000:,} {rng.choice(PAIRS)} @ {rng.uniform(0.6, 160):.4f} with {rng.choice(COUNTERPARTIES)}"
+    return (f"{rng.choice(SIDES)} {rng.randint(1, 100) * 100} shares of ${rng.choice(TICKERS)} "
+            f"@ {rng.uniform(10, 900):.2f} cpty {rng.choice(COUNTERPARTIES)} ref T{rng.randint(0, 10**8):08d}")
+
+
+def make_corpus(root, n_files, lines_per_file, seed):
+    rng = random.Random(seed)
+    per_dir = 500
+    for i in range(n_files):
+        folder = os.path.join(root, f"desk{i // per_dir:04d}")
+        if i % per_dir == 0:
+            os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, f"log{i:06d}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(fake_line(rng) for _ in range(lines_per_file)))
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))]  # noqa: E731
+    return {"p50_ms": pick(0.50) * 1000, "p95_ms": pick(0.95) * 1000, "p99_ms": pick(0.99) * 1000}
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--files", type=int, default=100_000)
+    ap.add_argument("--lines", type=int, default=20, help="lines per file")
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("--seed", type=int, default=7)
+    ap.add_argument("--keep", action="store_true", help="keep the generated corpus and index")
+    args = ap.parse_args()
+
+    work = tempfile.mkdtemp(prefix="search_bench_")
+    base_dir = os.path.join(work, "companyFiles")
+    company = os.path.join(base_dir, "bench_company")
+    os.makedirs(company)
+    try:
+        t0 = time.perf_counter()
+        make_corpus(company, args.files, args.lines, args.seed)
+        print(f"generated {args.files} files x {args.lines} lines in {time.perf_counter() - t0:.1f}s")
+
+        manager = SearchIndexManager(base_dir, os.path.join(work, "searchIndex"))
+        t0 = time.perf_counter()
+        manager.get_index("bench_company")  # fresh index -> full build
+        build = time.perf_counter() - t0
+        db_size = os.path.getsize(os.path.join(work, "searchIndex", "bench_company.db"))
+        print(f"index build:      {build:.2f}s ({args.files / build:,.0f} files/s, {db_size / 2**20:.1f} MiB on disk)")
+
+        rng = random.Random(args.seed + 1)
+        queries = {
+            "ticker":       lambda: f"${rng.choice(TICKERS)}",
+            "counterparty": lambda: rng.choice(COUNTERPARTIES),
+            "fx pair":      lambda: rng.choice(PAIRS),
+            "multi-term":   lambda: f"{rng.choice(SIDES)} {rng.choice(TICKERS)} {rng.choice(COUNTERPARTIES)}",
+            "trade ref":    lambda: f"T{rng.randint(0, 10**8):08d}",
+        }
+        for name, make in queries.items():
+            samples = []
+            for _ in range(args.queries):
+                q = make()
+                t0 = time.perf_counter()
+                manager.search(q, company, limit=50)
+                samples.append(time.perf_counter() - t0)
+            p = percentiles(samples)
+            print(f"query {name:13s} p50 {p['p50_ms']:8.2f} ms   p95 {p['p95_ms']:8.2f} ms   p99 {p['p99_ms']:8.2f} ms")
+
+        # incremental maintenance, the way the file routes drive it
+        target = os.path.join(company, "desk0000", "log000000.txt")
+        samples = []
+        for _ in range(20):
+            with open(target, "w", encoding="utf-8") as f:
+                f.write("\n".join(fake_line(rng) for _ in range(args.lines)))
+            t0 = time.perf_counter()
+            manager.update_file(target)
+            samples.append(time.perf_counter() - t0)
+        p = percentiles(samples)
+        print(f"update_file       p50 {p['p50_ms']:8.2f} ms   p95 {p['p95_ms']:8.2f} ms")
+
+        src, dst = os.path.join(company, "desk0000"), os.path.join(company, "moved_desk")
+        shutil.move(src, dst)
+        t0 = time.perf_counter()
+        manager.move_path(src, dst)
+        print(f"move_path (dir)   {(time.perf_counter() - t0) * 1000:8.2f} ms")
+
+        shutil.rmtree(dst)
+        t0 = time.perf_counter()
+        manager.remove_path(dst)
+        print(f"remove_path (dir) {(time.perf_counter() - t0) * 1000:8.2f} ms")
+    finally:
+        if args.keep:
+            print("kept", work)
+        else:
+            shutil.rmtree(work, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
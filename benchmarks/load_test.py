@@ -0,0 +1,109 @@
+"""
+Load test for the file endpoints: /file-info, /save-to-file and /directories
+
+Start the server one way, run this, then start it the other way and run it again:
+    python server.py                        # dev server  (http://127.0.0.1:5000)
+    python serve.py                         # production  (http://127.0.0.1:8000)
+
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 \\
+        --email someone@example.com --password secret --file firstFile.txt
+
+Each endpoint is hammered for --duration seconds by --concurrency client
+threads (each with its own login session), and throughput plus latency
+percentiles are printed. Saves rewrite --file with its own content, so the
+document is left unchanged.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+def make_client(url, email, password):
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+    body = json.dumps({"email": email, "password": password}).encode()
+    req = urllib.request.Request(url + "/login", data=body, headers={"Content-Type": "application/json"})
+    with opener.open(req) as res:
+        if json.load(res).get("status") != "ok":
+            raise SystemExit("login failed")
+    return opener
+
+
+def endpoint_requests(url, path, content):
+    """name -> function building a fresh Request for that endpoint"""
+    save_body = json.dumps({"path": path, "content": content}).encode()
+    return {
+        "/file-info": lambda: urllib.request.Request(f"{url}/file-info?path={urllib.parse.quote(path)}"),
+        "/save-to-file": lambda: urllib.request.Request(
+            url + "/save-to-file", data=save_body, headers={"Content-Type": "application/json"}),
+        "/directories": lambda: urllib.request.Request(url + "/directories"),
+    }
+
+
+def hammer(openers, make_request, duration):
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def worker(opener):
+        mine, failed = [], 0
+        while time.perf_counter() < stop_at:
+            t0 = time.perf_counter()
+            try:
+                with opener.open(make_request()) as res:
+                    res.read()
+                mine.append(time.perf_counter() - t0)
+            except (urllib.error.URLError, OSError):
+                failed += 1
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    threads = [threading.Thread(target=worker, args=(o,)) for o in openers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), errors[0]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--url", default="http://127.0.0.1:8000")
+    ap.add_argument("--email", required=True)
+    ap.add_argument("--password", required=True)
+    ap.add_argument("--file", required=True, help="file path as the editor sends it (relative to your root)")
+    ap.add_argument("--concurrency", type=int, default=32)
+    ap.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    ap.add_argument("--json", action="store_true", help="print the results as JSON")
+    args = ap.parse_args()
+
+    url = args.url.rstrip("/")
+    openers = [make_client(url, args.email, args.password) for _ in range(args.concurrency)]
+    with openers[0].open(f"{url}/file-info?path={urllib.parse.quote(args.file)}") as res:
+        content = json.load(res)["content"]
+
+    results = {}
+    for name, make_request in endpoint_requests(url, args.file, content).items():
+        lat, errors = hammer(openers, make_request, args.duration)
+        pick = lambda q: lat[min(len(lat) - 1, int(q * len(lat)))] * 1000 if lat else float("nan")  # noqa: E731
+        results[name] = {
+            "requests": len(lat), "errors": errors, "rps": len(lat) / args.duration,
+            "p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+        }
+        r = results[name]
+        if not args.json:
+            print(f"{name:14s} {r['rps']:8.1f} req/s   p50 {r['p50_ms']:7.2f} ms   "
+                  f"p95 {r['p95_ms']:7.2f} ms   p99 {r['p99_ms']:7.2f} ms   errors {errors}")
+    if args.json:
+        print(json.dumps({"url": url, "concurrency": args.concurrency, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
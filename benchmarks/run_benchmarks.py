@@ -0,0 +1,504 @@
+"""
+Benchmark suite: text data structures, Merkle builds and the Flask endpoints
+
+    python benchmarks/run_benchmarks.py                          # everything, default sizes
+    python benchmarks/run_benchmarks.py --groups text --sizes 1K,1M
+    python benchmarks/run_benchmarks.py --compare bench_results/old.json
+
+Groups
+- text:      editing traces against PieceTable, Rope and plain str
+               typing        single characters at a cursor that jumps now and then
+               cursor_local  small inserts/deletes within a few hundred chars of the cursor
+               block_paste   4-64 KB pastes at random positions
+               mass_delete   removes ~5% of the document per op
+             every case also times the final materialization (get_text / to_string)
+- merkle:    merkletree builds over the document split into lines (hashing through
+             a crypto.hash shim where merkle.py's import doesn't resolve)
+- storage:   plain vs compressed documents (serverFiles/Compressed_Store.py):
+             bytes on disk, full read, single-line read and re-save after a small edit
+- endpoints: /login, /file-info, /save-to-file, /directories and /search through
+             Flask's test client, with mongomock standing in for MongoDB and a
+             throwaway companyFiles folder
+
+Every case is seeded, so two runs do the same operations. A case stops early
+once it uses up --budget seconds and reports how many ops it got through.
+Results go to bench_results/<commit>.json; --compare prints the ratio against
+an older results file and flags anything more than --threshold slower.
+"""
+
+import argparse
+import hashlib
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "routes", "DataStructures"))
+
+from pieceTables import PieceTable  # noqa: E402
+from rope import Rope  # noqa: E402
+
+UNITS = {"K": 1024, "M": 1024 ** 2}
+WORDS = ["Buy", "Sell", "100", "shares", "of", "$AAPL", "@", "187.25", "cpty", "Citadel",
+         "EUR/USD", "1,000,000", "risk", "limit", "breach", "desk", "note:", "T+2", "settle"]
+
+
+def parse_size(text):
+    text = text.strip().upper()
+    if text[-1] in UNITS:
+        return int(float(text[:-1]) * UNITS[text[-1]])
+    return int(text)
+
+
+def size_label(n):
+    for unit, mult in (("M", 1024 ** 2), ("K", 1024)):
+        if n >= mult and n % mult == 0:
+            return f"{n // mult}{unit}"
+    return str(n)
+
+
+def make_document(size, rng):
+    lines, total = [], 0
+    while total < size:
+        line = " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 14)))
+        lines.append(line)
+        total += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+# -------------------------
+# text structures behind one interface
+# -------------------------
+class StrDoc:
+    def __init__(self, text):
+        self.s = text
+
+    def insert(self, pos, text):
+        self.s = self.s[:pos] + text + self.s[pos:]
+
+    def delete(self, pos, n):
+        self.s = self.s[:pos] + self.s[pos + n:]
+
+    def text(self):
+        return self.s
+
+
+class PieceTableDoc:
+    def __init__(self, text):
+        self.pt = PieceTable(text)
+
+    def insert(self, pos, text):
+        self.pt.insert(pos, text)
+
+    def delete(self, pos, n):
+        self.pt.delete(pos, n)
+
+    def text(self):
+        return self.pt.get_text()
+
+
+class RopeDoc:
+    def __init__(self, text):
+        self.rope = Rope(text)
+
+    def insert(self, pos, text):
+        self.rope.insert(pos, text)
+
+    def delete(self, pos, n):
+        self.rope.delete(pos, n)
+
+    def text(self):
+        return self.rope.to_string()
+
+
+IMPLS = {"str": StrDoc, "PieceTable": PieceTableDoc, "Rope": RopeDoc}
+
+
+# -------------------------
+# editing traces: generate (op, pos, arg) against a tracked length
+# -------------------------
+def trace_typing(size, ops, rng):
+    length, cursor = size, rng.randrange(size + 1)
+    for _ in range(ops):
+        if rng.random() < 0.02:  # click somewhere else
+            cursor = rng.randrange(length + 1)
+        if rng.random() < 0.1 and cursor > 0:  # backspace
+            cursor -= 1
+            length -= 1
+            yield "delete", cursor, 1
+        else:
+            yield "insert", cursor, rng.choice("abcdefghijklmnopqrstuvwxyz $.0123456789")
+            cursor += 1
+            length += 1
+
+
+def trace_cursor_local(size, ops, rng):
+    length, cursor = size, rng.randrange(size + 1)
+    for _ in range(ops):
+        pos = max(0, min(length, cursor + rng.randint(-200, 200)))
+        if rng.random() < 0.35 and pos < length:
+            n = min(rng.randint(1, 20), length - pos)
+            length -= n
+            yield "delete", pos, n
+        else:
+            word = rng.choice(WORDS) + " "
+            length += len(word)
+            yield "insert", pos, word
+        cursor = pos
+
+
+def trace_block_paste(size, ops, rng):
+    length = size
+    for _ in range(ops):
+        block = make_document(rng.randint(4, 64) * 1024, rng)
+        pos = rng.randrange(length + 1)
+        length += len(block)
+        yield "insert", pos, block
+
+
+def trace_mass_delete(size, ops, rng):
+    length = size
+    for _ in range(ops):
+        if length == 0:
+            return
+        n = max(1, length // 20)
+        pos = rng.randrange(length - n + 1)
+        length -= n
+        yield "delete", pos, n
+
+
+TRACES = {
+    "typing": trace_typing,
+    "cursor_local": trace_cursor_local,
+    "block_paste": trace_block_paste,
+    "mass_delete": trace_mass_delete,
+}
+
+
+def run_text(args, results):
+    for size in args.sizes:
+        doc_text = make_document(size, random.Random(args.seed))
+        for trace_name, trace in TRACES.items():
+            ops = args.ops if trace_name in ("typing", "cursor_local") else max(1, args.ops // 10)
+            # generate the trace up front so building paste blocks isn't timed
+            steps = list(trace(size, ops, random.Random(f"{args.seed}-{trace_name}-{size}")))
+            for impl_name, impl in IMPLS.items():
+                t0 = time.perf_counter()
+                doc = impl(doc_text)
+                load = time.perf_counter() - t0
+
+                done = 0
+                deadline = time.perf_counter() + args.budget
+                t0 = time.perf_counter()
+                for op, pos, arg in steps:
+                    doc.insert(pos, arg) if op == "insert" else doc.delete(pos, arg)
+                    done += 1
+                    if time.perf_counter() > deadline:
+                        break
+                edit = time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                doc.text()
+                materialize = time.perf_counter() - t0
+
+                results.append({
+                    "group": "text", "case": trace_name, "impl": impl_name, "size": size_label(size),
+                    "ops": done, "ops_planned": ops, "load_s": load, "edit_s": edit,
+                    "materialize_s": materialize,
+                    "ops_per_s": done / edit if edit else None,
+                    "us_per_op": edit / done * 1e6 if done else None,
+                })
+                report(results[-1])
+                del doc
+
+
+# -------------------------
+# merkle
+# -------------------------
+def _crypto_hash_shim():
+    """
+    merkle.py does `from crypto.hash import sha256`, which only resolves to pycryptodome's
+    Crypto.Hash on case-insensitive filesystems. Elsewhere, register a crypto.hash.sha256
+    module with the same new() (pycryptodome if it is installed, else hashlib) so the
+    build is still measured.
+    """
+    try:
+        importlib.import_module("crypto.hash")
+        return None
+    except ImportError:
+        pass
+    try:
+        from Crypto.Hash import SHA256
+        new, backend = SHA256.new, "Crypto.Hash.SHA256"
+    except ImportError:
+        new, backend = hashlib.sha256, "hashlib.sha256"
+    crypto, crypto_hash, sha256 = (types.ModuleType(n) for n in ("crypto", "crypto.hash", "crypto.hash.sha256"))
+    sha256.new = new
+    crypto.hash, crypto_hash.sha256 = crypto_hash, sha256
+    sys.modules.update({"crypto": crypto, "crypto.hash": crypto_hash, "crypto.hash.sha256": sha256})
+    return backend
+
+
+def run_merkle(args, results):
+    backend = _crypto_hash_shim()
+    from merkle import merkletree
+    for size in args.sizes:
+        leaves = make_document(size, random.Random(args.seed)).splitlines()
+        t0 = time.perf_counter()
+        root = merkletree(leaves).get_root()
+        elapsed = time.perf_counter() - t0
+        results.append({
+            "group": "merkle", "case": "build", "impl": "merkletree", "size": size_label(size),
+            "leaves": len(leaves), "build_s": elapsed, "root": root, "sha256": backend or "crypto.hash",
+        })
+        report(results[-1])
+
+
+# -------------------------
+# compressed storage
+# -------------------------
+def run_storage(args, results):
+    from serverFiles.Compressed_Store import CompressedStore
+
+    work = tempfile.mkdtemp(prefix="storage_bench_")
+    try:
+        base = os.path.join(work, "companyFiles")
+        os.makedirs(os.path.join(base, "company"))
+        stores = {
+            "plain": CompressedStore(base, os.path.join(work, "dicts"), enabled=False),
+            "compressed": CompressedStore(base, os.path.join(work, "dicts"), enabled=True),
+        }
+        for size in args.sizes:
+            text = make_document(size, random.Random(args.seed))
+            lines = text.count("\n") + 1
+            edited = text[:size // 2] + "Sell 250 shares of $MSFT cpty Virtu\n" + text[size // 2:]
+            for mode, store in stores.items():
+                path = os.path.join(base, "company", f"{mode}_{size_label(size)}.txt")
+                t0 = time.perf_counter()
+                store.write_text(path, text)
+                write = time.perf_counter() - t0
+                on_disk = os.path.getsize(path)
+
+                t0 = time.perf_counter()
+                store.read_text(path)
+                read = time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                store.read_line(path, lines // 2)
+                read_line = time.perf_counter() - t0
+
+                t0 = time.perf_counter()
+                info = store.write_text(path, edited)
+                resave = time.perf_counter() - t0
+
+                results.append({
+                    "group": "storage", "case": mode, "impl": store.codec if store.enabled else "none",
+                    "size": size_label(size), "bytes_on_disk": on_disk, "ratio": size / on_disk,
+                    "write_s": write, "read_s": read, "read_line_s": read_line, "resave_s": resave,
+                    "blocks_reused": info.get("reused"),
+                })
+                report(results[-1])
+                os.remove(path)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+# -------------------------
+# endpoints
+# -------------------------
+def run_endpoints(args, results):
+    try:
+        import mongomock
+        import pymongo
+    except ImportError as e:
+        results.append({"group": "endpoints", "skipped": f"needs mongomock and pymongo ({e})"})
+        report(results[-1])
+        return
+
+    work = tempfile.mkdtemp(prefix="endpoint_bench_")
+    pymongo.MongoClient = mongomock.MongoClient  # server.py connects at import time
+    os.environ["METRICS_DIR"] = os.path.join(work, "metrics")  # keep out of a running server's /metrics
+    import server
+    from werkzeug.security import generate_password_hash
+    from serverFiles.Auth_Cache import AllowedRoots
+    from serverFiles.Compressed_Store import CompressedStore
+    from serverFiles.Search_Index import SearchIndexManager
+
+    try:
+        # point the app at a scratch companyFiles (and dictionaries / index) so the real ones are never touched
+        base = os.path.join(work, "companyFiles")
+        company_id = "0" * 24
+        company = os.path.join(base, company_id)
+        os.makedirs(company)
+        server.BASE_DIR = base
+        server.allowed_roots = AllowedRoots(base)
+        # same DOC_STORAGE setting as the real server, so the storage mode under test is what it would run
+        store = CompressedStore(base, os.path.join(work, "compressionDicts"))
+        server.doc_store = store
+        server.search_index = SearchIndexManager(base, os.path.join(work, "searchIndex"),
+                                                 read_text=store.read_text, read_line=store.read_line)
+        server.users_col.delete_many({})
+        server.users_col.insert_one({
+            "email": "bench@example.com", "password_hash": generate_password_hash("bench"),
+            "company_id": company_id, "role": "employee", "name": "Bench",
+        })
+
+        rng = random.Random(args.seed)
+        for i in range(args.tree_files):
+            folder = os.path.join(company, f"desk{i // 50:03d}")
+            os.makedirs(folder, exist_ok=True)
+            with open(os.path.join(folder, f"log{i:05d}.txt"), "w", encoding="utf-8") as f:
+                f.write(make_document(2048, rng))
+        doc_sizes = [s for s in args.sizes if s <= args.max_endpoint_size]
+        for size in doc_sizes:
+            with open(os.path.join(company, f"doc_{size_label(size)}.txt"), "w", encoding="utf-8") as f:
+                f.write(make_document(size, rng))
+
+        client = server.app.test_client()
+        server.search_index.get_index(company_id)  # build the index up front, not inside the first /search
+
+        def bench(case, size, call):
+            samples = []
+            deadline = time.perf_counter() + args.budget
+            for _ in range(args.requests):
+                t0 = time.perf_counter()
+                res = call()
+                samples.append(time.perf_counter() - t0)
+                if res.status_code != 200:
+                    raise RuntimeError(f"{case}: HTTP {res.status_code} {res.get_data(as_text=True)[:200]}")
+                if time.perf_counter() > deadline:
+                    break
+            samples.sort()
+            pick = lambda q: samples[min(len(samples) - 1, int(q * len(samples)))] * 1000  # noqa: E731
+            results.append({
+                "group": "endpoints", "case": case, "impl": "flask", "size": size,
+                "requests": len(samples), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+                "mean_ms": sum(samples) / len(samples) * 1000,
+            })
+            report(results[-1])
+
+        login = {"email": "bench@example.com", "password": "bench"}
+        bench("/login", None, lambda: client.post("/login", json=login))
+        for size in doc_sizes:
+            name = f"doc_{size_label(size)}.txt"
+            content = client.get(f"/file-info?path={name}").get_json()["content"]
+            bench("/file-info", size_label(size), lambda: client.get(f"/file-info?path={name}"))
+            bench("/save-to-file", size_label(size),
+                  lambda: client.post("/save-to-file", json={"path": name, "content": content}))
+        bench("/directories", f"{args.tree_files} files", lambda: client.get("/directories"))
+        server.index_jobs.submit(lambda: None).result()  # let pending index updates land first
+        bench("/search", f"{args.tree_files} files", lambda: client.get("/search?q=$AAPL Citadel"))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+
+# -------------------------
+# reporting
+# -------------------------
+def report(row):
+    if "skipped" in row:
+        print(f"[{row['group']}] skipped: {row['skipped']}")
+    elif row["group"] == "text":
+        print(f"[text] {row['case']:13s} {row['impl']:10s} {row['size']:>5s}  "
+              f"{row['ops']:6d} ops  {row['us_per_op'] or 0:12.1f} us/op  "
+              f"materialize {row['materialize_s'] * 1000:9.2f} ms")
+    elif row["group"] == "storage":
+        print(f"[storage] {row['case']:10s} {row['size']:>5s}  {row['ratio']:5.2f}x smaller  "
+              f"write {row['write_s'] * 1000:9.2f} ms  read {row['read_s'] * 1000:9.2f} ms  "
+              f"line {row['read_line_s'] * 1000:7.2f} ms  resave {row['resave_s'] * 1000:9.2f} ms")
+    elif row["group"] == "merkle":
+        print(f"[merkle] {row['size']:>5s}  {row['leaves']} leaves  {row['build_s'] * 1000:9.2f} ms  ({row['sha256']})")
+    else:
+        print(f"[endpoints] {row['case']:13s} {str(row['size'] or ''):>12s}  p50 {row['p50_ms']:8.2f} ms  "
+              f"p95 {row['p95_ms']:8.2f} ms  p99 {row['p99_ms']:8.2f} ms")
+
+
+def git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+        return out.stdout.strip() or "unknown"
+    except OSError:
+        return "unknown"
+
+
+METRICS = ("us_per_op", "materialize_s", "build_s", "write_s", "read_s", "read_line_s", "resave_s",
+           "p50_ms", "p95_ms")
+
+
+def compare(old_path, new):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    key = lambda r: (r.get("group"), r.get("case"), r.get("impl"), r.get("size"))  # noqa: E731
+    before = {key(r): r for r in old["results"] if "skipped" not in r}
+    regressions = 0
+    print(f"\ncompared with {old['meta']['commit']} (ratio > 1 means slower now)")
+    for row in new["results"]:
+        prev = before.get(key(row))
+        if not prev:
+            continue
+        for metric in METRICS:
+            if metric.endswith("_s") and (prev.get(metric) or 0) < 1e-3:
+                continue  # sub-millisecond timings are mostly noise
+            if prev.get(metric) and row.get(metric) is not None:
+                ratio = row[metric] / prev[metric]
+                flag = "  <-- regression" if ratio > 1 + new["meta"]["threshold"] else ""
+                regressions += bool(flag)
+                print(f"  {' '.join(str(k) for k in key(row) if k):45s} {metric:14s} {ratio:6.2f}x{flag}")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--groups", default="text,merkle,storage,endpoints")
+    ap.add_argument("--sizes", default="1K,100K,1M,10M,100M", help="document sizes, e.g. 1K,1M")
+    ap.add_argument("--ops", type=int, default=500, help="ops per typing/cursor trace (paste/delete use a tenth)")
+    ap.add_argument("--budget", type=float, default=20.0, help="max seconds per case")
+    ap.add_argument("--requests", type=int, default=200, help="requests per endpoint case")
+    ap.add_argument("--tree-files", type=int, default=500, help="files in the /directories and /search tree")
+    ap.add_argument("--max-endpoint-size", default="10M", help="largest document served through the endpoints")
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--out", help="results file (default bench_results/<commit>.json)")
+    ap.add_argument("--compare", help="older results file to compare against")
+    ap.add_argument("--threshold", type=float, default=0.10, help="slowdown ratio flagged as a regression")
+    args = ap.parse_args()
+    args.sizes = [parse_size(s) for s in args.sizes.split(",")]
+    args.max_endpoint_size = parse_size(args.max_endpoint_size)
+    groups = args.groups.split(",")
+
+    results = []
+    for name, fn in (("text", run_text), ("merkle", run_merkle), ("storage", run_storage),
+                     ("endpoints", run_endpoints)):
+        if name in groups:
+            fn(args, results)
+
+    commit = git_commit()
+    out = {
+        "meta": {
+            "commit": commit, "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "seed": args.seed, "sizes": [size_label(s) for s in args.sizes], "ops": args.ops,
+            "budget": args.budget, "threshold": args.threshold,
+        },
+        "results": results,
+    }
+    path = args.out or os.path.join(ROOT, "bench_results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(out, f, indent=2)
+    print(f"\nresults written to {path}")
+
+    if args.compare and compare(args.compare, out):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Production entry point: serves server.py's app with several worker processes,
+each running a pool of threads, instead of Flask's single debug server.
+
+    pip install gunicorn          # Linux / macOS
+    pip install waitress          # Windows (or anywhere gunicorn isn't available)
+    python serve.py
+
+Settings (environment variables):
+    HOST          default 0.0.0.0
+    PORT          default 8000
+    WEB_WORKERS   worker processes, default 2 * cores + 1 (gunicorn only)
+    WEB_THREADS   threads per worker, default 8
+    SERVER        force "gunicorn" or "waitress"
+    METRICS_DIR   where workers share their /metrics numbers, default ./metrics
+
+Every handler does blocking Mongo / disk work, so each one runs on its own
+worker thread and the processes let requests use all the cores. Anything
+per-process (the login cache, the search index thread) is safe to duplicate:
+the search index is sqlite and handles several writers.
+
+gunicorn recycles its workers every ~10000 requests, which would kill a bulk
+job running inside one, so with gunicorn the workers only queue bulk jobs and
+a separate job process (restarted if it dies) runs them.
+"""
+
+import atexit
+import importlib.util
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", "8000"))
+WORKERS = int(os.environ.get("WEB_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+THREADS = int(os.environ.get("WEB_THREADS", "8"))
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "metrics"))
+
+
+JOB_PROCESS_ARG = "--bulk-jobs"
+
+
+def job_process():
+    import server  # noqa: F401  (importing it starts the job scheduler and the search index thread)
+    threading.Event().wait()
+
+
+def start_job_process():
+    """Run bulk jobs in their own process next to the web workers; restart it if it dies."""
+    master = os.getpid()
+    state = {"proc": None, "stopping": False}
+    env = dict(os.environ, BULK_RUNNER="local")
+
+    def supervise():
+        while not state["stopping"]:
+            state["proc"] = subprocess.Popen([sys.executable, os.path.abspath(__file__), JOB_PROCESS_ARG], env=env)
+            code = state["proc"].wait()
+            time.sleep(1)  # don't spin if it dies right away, and let a shutdown set stopping first
+            if not state["stopping"]:
+                print(f"bulk job process exited with {code}, restarting", file=sys.stderr)
+
+    def stop():
+        if os.getpid() != master:
+            return  # gunicorn workers are forked from here and inherit this hook
+        state["stopping"] = True
+        if state["proc"]:
+            state["proc"].terminate()
+
+    atexit.register(stop)
+    threading.Thread(target=supervise, name="bulk-job-supervisor", daemon=True).start()
+
+
+def retire_worker_metrics(server, worker):
+    """gunicorn master hook: fold an exited worker's /metrics file into the retired totals."""
+    from serverFiles.Metrics import retire
+    try:
+        retire(METRICS_DIR, worker.pid)
+    except OSError as e:
+        print(f"could not retire metrics of worker {worker.pid}: {e}", file=sys.stderr)
+
+
+def run_gunicorn():
+    from gunicorn.app.base import BaseApplication
+
+    class App(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{HOST}:{PORT}")
+            self.cfg.set("workers", WORKERS)
+            self.cfg.set("threads", THREADS)
+            self.cfg.set("worker_class", "gthread")
+            self.cfg.set("timeout", 60)
+            self.cfg.set("keepalive", 5)
+            # recycle workers now and then so a slow leak can't build up
+            self.cfg.set("max_requests", 10000)
+            self.cfg.set("max_requests_jitter", 1000)
+            # no preload: every worker needs its own MongoClient (they aren't fork-safe)
+            self.cfg.set("child_exit", retire_worker_metrics)
+
+        def load(self):
+            from server import app
+            return app
+
+    start_job_process()
+    os.environ["BULK_RUNNER"] = "process"  # read by server.py in every worker
+    print(f"gunicorn on {HOST}:{PORT}: {WORKERS} workers x {THREADS} threads + a bulk job process")
+    App().run()
+
+
+def run_waitress():
+    from waitress import serve
+    from server import app
+
+    # waitress is a single process, so give it the threads the gunicorn workers would have had
+    print(f"waitress on {HOST}:{PORT}: {THREADS} threads")
+    serve(app, host=HOST, port=PORT, threads=THREADS)
+
+
+def main():
+    if sys.argv[1:] == [JOB_PROCESS_ARG]:
+        return job_process()
+    choice = os.environ.get("SERVER")
+    if not choice:
+        choice = "waitress" if os.name == "nt" else "gunicorn"
+    if importlib.util.find_spec(choice) is None:
+        other = "waitress" if choice == "gunicorn" else "gunicorn"
+        sys.exit(f"{choice} is not installed. Run 'pip install {choice}' or set SERVER={other}.")
+
+    from serverFiles.Metrics import clear_shared
+    clear_shared(METRICS_DIR)  # numbers from the previous run would count twice
+    run_gunicorn() if choice == "gunicorn" else run_waitress()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,20 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for,send_from_directory
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for,send_from_directory, Response
 from werkzeug.security import generate_password_hash, check_password_hash
 from pymongo import MongoClient
 import os, shutil, uuid
+from concurrent.futures import ThreadPoolExecutor
 from bson import ObjectId
+from serverFiles.Search_Index import SearchIndexManager
+from serverFiles.Auth_Cache import UserCache, AllowedRoots
+from serverFiles.Compressed_Store import CompressedStore, is_temp_file
+from serverFiles.Bulk_Jobs import JobScheduler
+from serverFiles.Request_Log import setup_logging, log_event, Timer
+from serverFiles import Metrics
+from serverFiles.Metrics import stage, timed, Profiler
 
 app = Flask(__name__)
-app.secret_key = "super-secret-key"  # change in production
+app.secret_key = os.environ.get("SECRET_KEY", "super-secret-key")  # set SECRET_KEY in production
+setup_logging()
 
 # ---------------- MongoDB ----------------
 client = MongoClient("mongodb://localhost:27017/")
@@ -17,29 +26,81 @@ users_col = db["users"]
 BASE_DIR = os.path.join(app.root_path, "companyFiles")
 os.makedirs(BASE_DIR, exist_ok=True)
 
+# ---------------- Auth caches ----------------
+# user records for login (per process, USER_CACHE_TTL seconds) and the normalized folder each role/company may touch
+user_cache = UserCache(ttl=int(os.environ.get("USER_CACHE_TTL", "60")))
+allowed_roots = AllowedRoots(BASE_DIR)
+
+# ---------------- Document storage ----------------
+# plain files unless DOC_STORAGE=compressed; reads always handle both
+doc_store = CompressedStore(BASE_DIR, os.path.join(app.root_path, "compressionDicts"))
+
+# ---------------- Search index ----------------
+# one on-disk index per company folder, kept up to date by the file routes below
+search_index = SearchIndexManager(BASE_DIR, os.path.join(app.root_path, "searchIndex"),
+                                  read_text=doc_store.read_text, read_line=doc_store.read_line)
+# index maintenance runs on its own thread so saves don't wait for it (one worker keeps the order)
+index_jobs = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+# ---------------- Bulk jobs ----------------
+# bulk move/copy/delete run on a small pool; progress is kept in Mongo so any worker can report it.
+# Under serve.py the web workers only queue jobs (BULK_RUNNER=process) and a separate job process runs them.
+MAX_BULK_ITEMS = 10000
+
+def reindex_after_bulk(kind, changes):
+    """Update the search index once per finished job instead of once per file."""
+    # queued behind the single-file updates so they are applied in the order they happened
+    if kind == "delete":
+        index_jobs.submit(search_index.apply_batch, removed=[src for src, _ in changes])
+    elif kind == "move":
+        index_jobs.submit(search_index.apply_batch, moved=changes)
+    else:
+        index_jobs.submit(search_index.apply_batch, added=[dst for _, dst in changes])
+
+def reindex_after_orphan(kind, paths):
+    """A job died half way and nobody knows which items made it: rebuild the indexes it could have touched."""
+    index_jobs.submit(search_index.reindex_paths, paths)
+
+bulk_jobs = JobScheduler(db["bulk_jobs"], max_workers=int(os.environ.get("BULK_WORKERS", "4")),
+                         on_finished=reindex_after_bulk, on_orphaned=reindex_after_orphan,
+                         run_jobs=os.environ.get("BULK_RUNNER") != "process")
+
+# ---------------- Metrics ----------------
+# latency histograms for every route (see /metrics); the sampling profiler is opt-in with ENABLE_PROFILER=1
+profiler = Profiler(os.path.join(app.root_path, "profiles")) if os.environ.get("ENABLE_PROFILER") == "1" else None
+# every worker process drops its numbers here so /metrics can add them all up
+METRICS_DIR = os.environ.get("METRICS_DIR", os.path.join(app.root_path, "metrics"))
+Metrics.share_dir(METRICS_DIR)
+
+@app.before_request
+def start_timer():
+    Metrics.begin_request(request.endpoint)
+
+@app.after_request
+def stop_timer(response):
+    Metrics.end_request(request.method, response.status_code)
+    return response
+
 # ----------------- Helpers -----------------
 
+@timed("auth")
 def get_base_dir():
     """Returns the base directory accessible to the user."""
-    role = session.get("role")
-    if role == "admin":
-        return BASE_DIR  # Admin can see all company folders
-    company_id = session.get("company_id")
-    if not company_id:
-        return None
-    return os.path.join(BASE_DIR, company_id)
+    # Admin gets all company folders, employees only their own
+    return allowed_roots.root_for(session.get("role"), session.get("company_id"))
 
+@timed("auth")
 def is_path_allowed(abs_path):
     """Check if path is within the allowed directory."""
-    base_dir = get_base_dir()
-    if not base_dir:
-        return False
-    return abs_path.startswith(os.path.abspath(base_dir))
+    root = allowed_roots.root_for(session.get("role"), session.get("company_id"))
+    return allowed_roots.allows(root, abs_path)
 
 def build_tree(path, parent_rel=""):
     items = []
     try:
         for entry in os.listdir(path):
+            if is_temp_file(entry):
+                continue  # a compressed save in progress
             full_path = os.path.join(path, entry)
             rel_path = os.path.join(parent_rel, entry)
             if os.path.isfile(full_path):
@@ -72,6 +133,7 @@ def node_modules(filename):
 # ---------- Logout ----------
 @app.route("/logout")
 def logout():
+    user_cache.invalidate(session.get("user_id"))  # next login re-reads the user from Mongo
     session.clear()  # remove all session data
     return redirect(url_for("login_page"))
 # ---------- Company Sign-Up ----------
@@ -94,13 +156,15 @@ def company_signup():
     }).inserted_id
 
     # Create admin user for company
+    admin_email = f"{name.lower().replace(' ','')}_admin@example.com"
     users_col.insert_one({
         "name": name + " Admin",
-        "email": f"{name.lower().replace(' ','')}_admin@example.com",
+        "email": admin_email,
         "password_hash": password_hash,
         "company_id": company_id,
         "role": "admin"
     })
+    user_cache.invalidate(email=admin_email)
 
     # Create company directory
     company_dir = os.path.join(BASE_DIR, str(company_id))
@@ -121,11 +185,10 @@ def employee_signup():
         return jsonify({"status": "error", "message": "All fields required"}), 400
 
     # Find any company that matches the password
-    for comp in companies_col.find():
-        if check_password_hash(comp["password_hash"], company_password):
-            company = comp
-            break
-    else:
+    with stage("auth"):
+        company = next((comp for comp in companies_col.find()
+                        if check_password_hash(comp["password_hash"], company_password)), None)
+    if company is None:
         return jsonify({"status": "error", "message": "Invalid company password"}), 400
 
     if users_col.find_one({"email": email}):
@@ -139,6 +202,7 @@ def employee_signup():
         "company_id": company["_id"],
         "role": "employee"
     })
+    user_cache.invalidate(email=email)
 
     return jsonify({"status": "ok", "message": f"{name} registered under {company['name']}"})
 
@@ -152,10 +216,23 @@ def login():
     if not all([email, password]):
         return jsonify({"status": "error", "message": "Email and password required"}), 400
 
-    user = users_col.find_one({"email": email})
-    if not user or not check_password_hash(user["password_hash"], password):
+    # credentials always come from Mongo (just the hash), so a changed password or a deleted
+    # user takes effect at once; only the rest of the record is cached
+    with stage("mongo"):
+        creds = users_col.find_one({"email": email}, {"password_hash": 1})
+    with stage("auth"):
+        valid = bool(creds) and check_password_hash(creds["password_hash"], password)
+    if not valid:
         return jsonify({"status": "error", "message": "Invalid credentials"}), 400
 
+    user = user_cache.get(creds["_id"])
+    if not user:
+        with stage("mongo"):
+            user = users_col.find_one({"_id": creds["_id"]})
+        if not user:
+            return jsonify({"status": "error", "message": "Invalid credentials"}), 400
+        user_cache.put(user)
+
     session["user_id"] = str(user["_id"])
     session["company_id"] = str(user["company_id"])
     session["role"] = user["role"]
@@ -174,7 +251,8 @@ def get_dirs():
         tree = []
 
         # Include files in root
-        root_files = build_tree(BASE_DIR, "")
+        with stage("build_tree"):
+            root_files = build_tree(BASE_DIR, "")
         for item in root_files:
             # skip company folders (they will be added separately)
             if item["type"] == "dir" and ObjectId.is_valid(item["name"]):
@@ -186,27 +264,33 @@ def get_dirs():
             company_path = os.path.join(BASE_DIR, company_id)
             if os.path.isdir(company_path) and ObjectId.is_valid(company_id):
                 try:
-                    company_obj = companies_col.find_one({"_id": ObjectId(company_id)})
+                    with stage("mongo"):
+                        company_obj = companies_col.find_one({"_id": ObjectId(company_id)})
                     display_name = company_obj["name"] if company_obj else company_id
                 except:
                     display_name = company_id
+                with stage("build_tree"):
+                    children = build_tree(company_path, company_id)
                 tree.append({
                     "name": display_name,
                     "type": "dir",
                     "path": company_id,
-                    "children": build_tree(company_path, company_id)
+                    "children": children
                 })
 
-        return jsonify({"status": "ok", "files": tree})
+        with stage("serialize"):
+            return jsonify({"status": "ok", "files": tree})
 
     # Employee: only their company
-    return jsonify({"status": "ok", "files": build_tree(base_dir)})
+    with stage("build_tree"):
+        tree = build_tree(base_dir)
+    with stage("serialize"):
+        return jsonify({"status": "ok", "files": tree})
 
 # ---------- File Info ----------
 @app.route("/file-info")
 def file_info():
     rel_path = request.args.get("path")
-    print(session)
     if not rel_path:
         return jsonify({"status": "error", "message": "No file specified"}), 400
 
@@ -218,14 +302,17 @@ def file_info():
     if not os.path.isfile(abs_path) or not is_path_allowed(abs_path):
         return jsonify({"status": "error", "message": "Invalid file path"}), 400
 
-    with open(abs_path, "r", encoding="utf-8") as f:
-        content = f.read()
-    return jsonify({"status": "ok", "name": os.path.basename(abs_path), "content": content})
+    with Timer() as t, stage("disk_read"):
+        content = doc_store.read_text(abs_path)
+    log_event("file_info", user=session.get("user_id"), path=rel_path, chars=len(content), read_ms=round(t.ms, 2))
+    with stage("serialize"):
+        return jsonify({"status": "ok", "name": os.path.basename(abs_path), "content": content})
 
 # ---------- Save File ----------
 @app.route("/save-to-file", methods=["POST"])
 def save_to_file():
-    data = request.json
+    with stage("parse"):
+        data = request.json
     text = data.get("content", "")
     rel_path = data.get("path")
     if not rel_path:
@@ -233,16 +320,14 @@ def save_to_file():
 
     base_dir = get_base_dir()
     abs_path = os.path.abspath(os.path.join(base_dir, rel_path))
-
-    print("Base dir:", base_dir)
-    print("Rel path:", rel_path)
-    print("Abs path:", abs_path)
     if not is_path_allowed(abs_path):
         return jsonify({"status": "error", "message": "Invalid path"}), 400
 
     os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-    with open(abs_path, "w", encoding="utf-8") as f:
-        f.write(text)
+    with Timer() as t, stage("disk_write"):
+        stored = doc_store.write_text(abs_path, text)
+    log_event("save_to_file", user=session.get("user_id"), path=rel_path, chars=len(text), write_ms=round(t.ms, 2), **stored)
+    index_jobs.submit(search_index.update_file, abs_path)
     return jsonify({"status": "ok"})
 
 # ---------- Create File ----------
@@ -260,6 +345,7 @@ def create_file():
 
     os.makedirs(os.path.dirname(abs_path), exist_ok=True)
     open(abs_path, "w", encoding="utf-8").close()
+    index_jobs.submit(search_index.update_file, abs_path)
     return jsonify({"status": "ok", "message": f"File '{rel_path}' created"})
 
 # ---------- Create Directory ----------
@@ -292,6 +378,7 @@ def delete_file_or_dir():
         os.remove(abs_path)
     elif os.path.isdir(abs_path):
         shutil.rmtree(abs_path)
+    index_jobs.submit(search_index.remove_path, abs_path)
     return jsonify({"status": "ok"})
 
 # ---------- Move File/Directory ----------
@@ -309,9 +396,124 @@ def move_file_or_dir():
         return jsonify({"status": "error", "message": "Invalid path"}), 400
 
     os.makedirs(new_abs_dir, exist_ok=True)
-    shutil.move(abs_path, os.path.join(new_abs_dir, os.path.basename(rel_path)))
+    new_abs_path = os.path.join(new_abs_dir, os.path.basename(rel_path))
+    shutil.move(abs_path, new_abs_path)
+    index_jobs.submit(search_index.move_path, abs_path, new_abs_path)
     return jsonify({"status": "ok"})
 
+# ---------- Bulk Move/Copy/Delete ----------
+def start_bulk_job(kind):
+    """Validate every path up front, then hand the whole list to the job scheduler."""
+    data = request.json or {}
+    paths = data.get("paths")
+    if not isinstance(paths, list) or not paths:
+        return jsonify({"status": "error", "message": "No paths specified"}), 400
+    if len(paths) > MAX_BULK_ITEMS:
+        return jsonify({"status": "error", "message": f"At most {MAX_BULK_ITEMS} paths per request"}), 400
+
+    base_dir = get_base_dir()
+    if not base_dir:
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    new_abs_dir = None
+    if kind != "delete":
+        new_dir_rel = data.get("newDir")
+        if not isinstance(new_dir_rel, str):
+            return jsonify({"status": "error", "message": "No destination directory specified"}), 400
+        new_abs_dir = os.path.abspath(os.path.join(base_dir, new_dir_rel))
+        if not is_path_allowed(new_abs_dir):
+            return jsonify({"status": "error", "message": "Invalid destination"}), 400
+
+    items, bad = [], []
+    for rel_path in paths:
+        abs_path = os.path.abspath(os.path.join(base_dir, rel_path)) if isinstance(rel_path, str) else None
+        # the root folder itself can't be moved or deleted
+        if not abs_path or abs_path == base_dir or not is_path_allowed(abs_path):
+            bad.append(rel_path)
+        else:
+            items.append(abs_path)
+    if bad:
+        return jsonify({"status": "error", "message": "Invalid path", "paths": bad[:50]}), 400
+
+    job_id = bulk_jobs.submit(kind, items, session.get("user_id"), new_abs_dir, labels=paths)
+    return jsonify({"status": "ok", "job_id": job_id, "total": len(items)}), 202
+
+@app.route("/bulk/move", methods=["POST"])
+def bulk_move():
+    return start_bulk_job("move")
+
+@app.route("/bulk/copy", methods=["POST"])
+def bulk_copy():
+    return start_bulk_job("copy")
+
+@app.route("/bulk/delete", methods=["POST"])
+def bulk_delete():
+    return start_bulk_job("delete")
+
+# ---------- Job Status ----------
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    if "user_id" not in session:
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    with stage("mongo"):
+        job = bulk_jobs.get(job_id)
+    # other users' jobs look exactly like missing ones
+    if not job or (job["owner"] != session.get("user_id") and session.get("role") != "admin"):
+        return jsonify({"status": "error", "message": "No such job"}), 404
+
+    job["job_id"] = job.pop("_id")
+    return jsonify({"status": "ok", "job": job})
+
+# ---------- Search ----------
+@app.route("/search")
+def search():
+    query = request.args.get("q", "").strip()
+    if not query:
+        return jsonify({"status": "error", "message": "No search query specified"}), 400
+
+    base_dir = get_base_dir()
+    if not base_dir:
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    try:
+        limit = min(int(request.args.get("limit", 50)), 500)
+    except ValueError:
+        return jsonify({"status": "error", "message": "Invalid limit"}), 400
+
+    results = search_index.search(query, base_dir, limit=limit)
+    with stage("serialize"):
+        return jsonify({"status": "ok", "results": results})
+
+# ---------- Metrics ----------
+@app.route("/metrics")
+def metrics():
+    return Response(Metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+# ---------- Profiler (opt-in) ----------
+@app.route("/debug/profile", methods=["POST"])
+def start_profile():
+    # samples this worker process only; the pid in the reply tells which one answered
+    if profiler is None:
+        return jsonify({"status": "error", "message": "Profiler disabled (set ENABLE_PROFILER=1)"}), 404
+    if session.get("role") != "admin":
+        return jsonify({"status": "error", "message": "Unauthorized"}), 403
+
+    data = request.json or {}
+    try:
+        seconds = min(float(data.get("seconds", 10)), 300)
+        interval = max(float(data.get("interval", 0.005)), 0.001)
+    except (TypeError, ValueError):
+        return jsonify({"status": "error", "message": "Invalid seconds/interval"}), 400
+
+    path = profiler.start(seconds, interval)
+    if not path:
+        return jsonify({"status": "error", "message": "A profile is already running"}), 409
+    return jsonify({"status": "ok", "file": os.path.relpath(path, app.root_path), "seconds": seconds,
+                    "pid": os.getpid()})
+
 # ----------------- Run App -----------------
+# development server only; use serve.py for the multi-worker production profile
 if __name__ == "__main__":
+    Metrics.clear_shared(METRICS_DIR)
     app.run(debug=True)
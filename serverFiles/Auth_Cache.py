@@ -0,0 +1,110 @@
+import os
+import threading
+import time
+
+
+class UserCache:
+    """
+    Per-process cache of user records keyed by user_id (emails map back to ids for invalidation) and a TTL.
+
+    Password hashes are never cached: login checks credentials against Mongo and only
+    takes the rest of the record (role, company) from here. Only this process's own
+    writes invalidate it, so a role / company change made elsewhere (another worker,
+    a script, Mongo directly) can be served stale for up to ttl seconds.
+    """
+
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._by_id = {}     # user_id -> (expires_at, record)
+        self._by_email = {}  # email -> user_id
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Cached record for user_id, or None if missing/expired."""
+        with self._lock:
+            entry = self._by_id.get(str(user_id))
+            if not entry:
+                return None
+            expires_at, record = entry
+            if expires_at < time.monotonic():
+                self._drop(str(user_id))
+                return None
+            return record
+
+    def put(self, record):
+        """Cache a user document straight from users_col (without its password hash)."""
+        user_id = str(record["_id"])
+        record = {k: v for k, v in record.items() if k != "password_hash"}
+        with self._lock:
+            self._drop(user_id)
+            self._by_id[user_id] = (time.monotonic() + self.ttl, record)
+            if record.get("email"):
+                self._by_email[record["email"]] = user_id
+
+    def invalidate(self, user_id=None, email=None):
+        with self._lock:
+            if email and not user_id:
+                user_id = self._by_email.get(email)
+            if user_id:
+                self._drop(str(user_id))
+
+    def clear(self):
+        with self._lock:
+            self._by_id.clear()
+            self._by_email.clear()
+
+    def _drop(self, user_id):
+        # caller holds the lock
+        entry = self._by_id.pop(user_id, None)
+        if entry and entry[1].get("email"):
+            self._by_email.pop(entry[1]["email"], None)
+
+
+def is_within(path, root):
+    """True if path is root or below it, compared by whole path components
+    (so companyFiles/abc does not match companyFiles/abcd)."""
+    if path == root:
+        return True
+    return path.startswith(root if root.endswith(os.sep) else root + os.sep)
+
+
+class AllowedRoots:
+    """
+    Normalized root directory per role/company, computed once per process.
+    Paths are resolved with realpath so symlinks can't be used to climb out of a company folder.
+    """
+
+    def __init__(self, base_dir):
+        self.base_dir = os.path.normcase(os.path.realpath(base_dir))
+        self._companies = {}  # company_id -> normalized company folder
+        self._lock = threading.Lock()
+
+    def root_for(self, role, company_id):
+        """The folder a user may touch, or None if they have no access."""
+        if role == "admin":
+            return self.base_dir
+        if not company_id:
+            return None
+        root = self._companies.get(company_id)
+        if root is None:
+            root = os.path.normcase(os.path.realpath(os.path.join(self.base_dir, company_id)))
+            # a crafted company_id ("..", "a/../b") must not resolve anywhere else
+            if os.path.dirname(root) != self.base_dir:
+                return None
+            with self._lock:
+                self._companies[company_id] = root
+        return root
+
+    def invalidate(self, company_id=None):
+        with self._lock:
+            if company_id:
+                self._companies.pop(company_id, None)
+            else:
+                self._companies.clear()
+
+    @staticmethod
+    def allows(root, abs_path):
+        """True if abs_path (after resolving symlinks) lives inside root."""
+        if not root:
+            return False
+        return is_within(os.path.normcase(os.path.realpath(abs_path)), root)
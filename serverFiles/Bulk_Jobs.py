@@ -0,0 +1,251 @@
+"""
+Bulk move / copy / delete jobs
+
+A job is a list of already-validated absolute paths plus an operation. Jobs
+run on a bounded thread pool (so a huge reorganisation can't eat every
+thread the server has), and their progress lives in Mongo so any worker
+process can answer a status request:
+
+    {_id, kind, owner, status: queued | running | done | failed,
+     total, done, failed, errors: [{path, error}], created_at, started_at, finished_at,
+     host, pid, heartbeat, items, dst_dir, labels}   <- internal, get() leaves them out
+
+Items of one job run in order (moving a folder and then something into it
+has to work), and when the job is over on_finished gets every change that
+succeeded in one go, so caches like the search index are updated in a
+single batch.
+
+A scheduler created with run_jobs=False (the web workers under serve.py)
+only queues jobs with no owner pid; the job process serve.py starts claims
+them, so recycling a web worker never interrupts a job.
+
+Jobs still die with the process running them (a crash, a kill, a restart
+of the job process). Every scheduler bumps the heartbeat of its own jobs every
+HEARTBEAT_EVERY seconds and looks for jobs whose process is gone: heartbeat
+older than STALE_AFTER, or a dead pid on this host. Those are marked failed
+and on_orphaned(kind, paths) gets every path the job could have touched, since
+nobody knows which items made it.
+"""
+
+import logging
+import os
+import shutil
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from serverFiles.Auth_Cache import is_within
+
+log = logging.getLogger(__name__)
+
+MAX_ERRORS = 100        # errors kept on the job document
+PROGRESS_EVERY = 0.5    # seconds between progress writes to Mongo
+HEARTBEAT_EVERY = 10    # seconds between heartbeats of the jobs a process owns
+STALE_AFTER = 60        # a job without a heartbeat for this long is an orphan
+CLAIM_EVERY = 1         # seconds between looks for jobs queued by other processes
+PRIVATE_FIELDS = {"host": 0, "pid": 0, "heartbeat": 0, "items": 0, "dst_dir": 0, "labels": 0}
+
+
+def _same_device(src, dst_dir):
+    try:
+        return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+    except OSError:
+        return False
+
+
+def _target(src, dst_dir):
+    dst = os.path.join(dst_dir, os.path.basename(src.rstrip(os.sep)))
+    if is_within(dst_dir, src):
+        raise ValueError("cannot move or copy a folder into itself")
+    if os.path.exists(dst):
+        raise FileExistsError(f"'{os.path.basename(dst)}' already exists in the destination")
+    return dst
+
+
+def move_item(src, dst_dir):
+    dst = _target(src, dst_dir)
+    os.makedirs(dst_dir, exist_ok=True)
+    if _same_device(src, dst_dir):
+        os.rename(src, dst)  # a single metadata update, nothing is copied
+    else:
+        shutil.move(src, dst)
+    return dst
+
+
+def copy_item(src, dst_dir):
+    dst = _target(src, dst_dir)
+    os.makedirs(dst_dir, exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def delete_item(path, _dst_dir=None):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+    else:
+        raise FileNotFoundError("no such file or directory")
+    return None
+
+
+OPERATIONS = {"move": move_item, "copy": copy_item, "delete": delete_item}
+
+
+def _pid_alive(pid):
+    if os.name == "nt":
+        return True  # os.kill would terminate it on Windows; rely on the heartbeat there
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # exists, owned by someone else
+    return True
+
+
+class JobScheduler:
+    def __init__(self, jobs_col, max_workers=4, on_finished=None, on_orphaned=None, run_jobs=True):
+        self.jobs_col = jobs_col
+        self.on_finished = on_finished  # on_finished(kind, [(src, dst)]) once a job is over
+        self.on_orphaned = on_orphaned  # on_orphaned(kind, [abs path]) for a job whose process died
+        self.run_jobs = run_jobs        # False: only queue jobs, another process runs them
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="bulk-job") if run_jobs else None
+        self.host = socket.gethostname()
+        self._mine = set()  # ids of queued / running jobs owned by this process
+        self._lock = threading.Lock()
+        # recovery starts on the heartbeat thread, so an unreachable Mongo can't hold up the import
+        threading.Thread(target=self._heartbeat, name="bulk-job-heartbeat", daemon=True).start()
+        if run_jobs:
+            threading.Thread(target=self._claim_loop, name="bulk-job-claim", daemon=True).start()
+
+    def submit(self, kind, items, owner, dst_dir=None, labels=None):
+        """
+        Queue a job. items are absolute paths that have already been permission checked,
+        labels are the matching paths as the user sent them (used in error reports).
+        """
+        job_id = uuid.uuid4().hex
+        now = datetime.now()
+        labels = labels or items
+        if self.run_jobs:
+            with self._lock:
+                self._mine.add(job_id)
+        self.jobs_col.insert_one({
+            "_id": job_id, "kind": kind, "owner": owner, "status": "queued",
+            "total": len(items), "done": 0, "failed": 0, "errors": [],
+            "created_at": now, "started_at": None, "finished_at": None,
+            # no pid = waiting for the job process to claim it
+            "host": self.host if self.run_jobs else None, "pid": os.getpid() if self.run_jobs else None,
+            "heartbeat": now, "items": items, "dst_dir": dst_dir, "labels": labels,
+        })
+        if self.run_jobs:
+            self.pool.submit(self._run, job_id, kind, items, dst_dir, labels)
+        return job_id
+
+    def _claim_loop(self):
+        """Pick up jobs other processes queued without running them, oldest first."""
+        while True:
+            try:
+                job = self.jobs_col.find_one_and_update(
+                    {"status": "queued", "pid": None, "items": {"$exists": True}},
+                    {"$set": {"host": self.host, "pid": os.getpid(), "heartbeat": datetime.now()}},
+                    sort=[("created_at", 1)],
+                )
+            except Exception:
+                log.exception("claiming bulk jobs failed")
+                job = None
+            if job is None:
+                time.sleep(CLAIM_EVERY)
+                continue
+            with self._lock:
+                self._mine.add(job["_id"])
+            self.pool.submit(self._run, job["_id"], job["kind"], job["items"], job["dst_dir"],
+                             job.get("labels") or job["items"])
+
+    def get(self, job_id):
+        return self.jobs_col.find_one({"_id": job_id}, PRIVATE_FIELDS)
+
+    # ---- orphans ----
+    def _heartbeat(self):
+        while True:
+            try:
+                with self._lock:
+                    mine = list(self._mine)
+                if mine:
+                    self.jobs_col.update_many({"_id": {"$in": mine}}, {"$set": {"heartbeat": datetime.now()}})
+                self.recover_orphans()
+            except Exception:  # a Mongo hiccup must not stop the heartbeat for good
+                log.exception("bulk job heartbeat failed")
+            time.sleep(HEARTBEAT_EVERY)
+
+    def _orphaned(self, job, stale_before):
+        if job["_id"] in self._mine:
+            return False
+        if job.get("pid") is None and "items" in job:
+            return False  # still waiting for the job process, nothing has been touched yet
+        if job.get("heartbeat") is None or job["heartbeat"] < stale_before:
+            return True
+        # same machine: no need to wait for the heartbeat to go stale
+        return job.get("host") == self.host and (job.get("pid") == os.getpid() or not _pid_alive(job.get("pid")))
+
+    def recover_orphans(self, stale_after=STALE_AFTER):
+        """Fail queued / running jobs whose process is gone and report what they may have touched."""
+        stale_before = datetime.now() - timedelta(seconds=stale_after)
+        for job in self.jobs_col.find({"status": {"$in": ["queued", "running"]}}):
+            if not self._orphaned(job, stale_before):
+                continue
+            # claim it, so two processes recovering at once don't both report it
+            claimed = self.jobs_col.update_one({"_id": job["_id"], "status": job["status"]}, {"$set": {
+                "status": "failed", "finished_at": datetime.now(),
+                "errors": job.get("errors", [])[:MAX_ERRORS - 1] + [{
+                    "path": None,
+                    "error": "the server process running this job stopped; some items may not have been processed",
+                }],
+            }}).modified_count
+            if claimed and job["status"] == "running" and self.on_orphaned:
+                paths = list(job.get("items") or [])
+                if job.get("dst_dir"):
+                    paths.append(job["dst_dir"])
+                self.on_orphaned(job["kind"], paths)
+
+    def _run(self, job_id, kind, items, dst_dir, labels):
+        op = OPERATIONS[kind]
+        now = datetime.now()
+        self.jobs_col.update_one({"_id": job_id}, {"$set": {"status": "running", "started_at": now, "heartbeat": now}})
+        changes, errors = [], []
+        done = failed = 0
+        last_report = time.monotonic()
+        status = "done"
+        try:
+            for src, label in zip(items, labels):
+                try:
+                    changes.append((src, op(src, dst_dir)))
+                    done += 1
+                except (OSError, ValueError) as e:
+                    failed += 1
+                    if len(errors) < MAX_ERRORS:
+                        # strerror leaves out the absolute server path that str(e) would include
+                        errors.append({"path": label, "error": getattr(e, "strerror", None) or str(e)})
+                if time.monotonic() - last_report >= PROGRESS_EVERY:
+                    self.jobs_col.update_one({"_id": job_id}, {"$set": {
+                        "done": done, "failed": failed, "errors": errors, "heartbeat": datetime.now(),
+                    }})
+                    last_report = time.monotonic()
+        except Exception as e:  # keep the job document honest even if something unexpected blows up
+            status = "failed"
+            errors.append({"path": None, "error": repr(e)})
+        finally:
+            if self.on_finished and changes:
+                self.on_finished(kind, changes)
+            self.jobs_col.update_one({"_id": job_id}, {"$set": {
+                "status": status, "done": done, "failed": failed, "errors": errors[:MAX_ERRORS],
+                "finished_at": datetime.now(),
+            }})
+            with self._lock:
+                self._mine.discard(job_id)
@@ -0,0 +1,336 @@
+"""
+Optional compressed storage for company documents
+
+A compressed document lives at the same path as the plain one, so the file
+tree and the HTTP API don't change. File layout:
+
+    MAGIC | header length (4 bytes, big endian) | JSON header | block, block, ...
+
+    header = {"codec": "zlib" | "zstd", "dict": dict id or null,
+              "blocks": [[raw bytes, compressed bytes, lines, chars, sha1], ...]}
+
+- blocks are cut on line boundaries with content-defined chunking (a block
+  ends after a line whose crc32 hits CDC_MASK, within MIN/MAX_BLOCK), so
+  inserting text only changes the blocks around the edit and the rest keep
+  their hashes
+- a save re-uses the compressed bytes of every block whose hash it already
+  has and only compresses the new ones
+- range / line reads decompress just the blocks they touch
+- each company gets a shared dictionary (zstd trained dict, or a zlib preset
+  dictionary of its most common lines) stored under dict_dir/<company>/<id>.dict;
+  headers point at the dictionary id, so old files keep working after a new one is built
+
+Turned on with DOC_STORAGE=compressed. Plain files are always readable and
+documents under COMPRESS_MIN_BYTES are always written plain.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import tempfile
+import threading
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:  # optional, zlib is always there
+    zstandard = None
+
+MAGIC = b"RTDZ1\n"
+MIN_BLOCK = 16 * 1024
+MAX_BLOCK = 256 * 1024
+CDC_MASK = 511              # ~1 in 512 lines ends a block once MIN_BLOCK is reached
+COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", 16 * 1024))
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+DICT_SIZE = 32 * 1024       # zlib can't use more than a 32 KB window anyway
+DICT_SAMPLE_BYTES = 4 * 1024 * 1024
+DICT_MIN_SAMPLE = 64 * 1024  # don't bother building a dictionary from less than this
+TMP_PREFIX, TMP_SUFFIX = ".", ".tmp"  # a save in progress (or cut short by a crash)
+
+
+def split_blocks(data):
+    """Cut bytes into blocks on line boundaries using content-defined chunking."""
+    blocks = []
+    start = pos = 0
+    n = len(data)
+    while pos < n:
+        nl = data.find(b"\n", pos)
+        end = n if nl == -1 else nl + 1
+        size = end - start
+        if size >= MAX_BLOCK or (size >= MIN_BLOCK and (zlib.crc32(data[pos:end]) & CDC_MASK) == 0):
+            blocks.append(data[start:end])
+            start = end
+        pos = end
+    if start < n:
+        blocks.append(data[start:])
+    return blocks
+
+
+def is_temp_file(name):
+    """True for the hidden temp files write_text saves through; listings and the search index skip them."""
+    return name.startswith(TMP_PREFIX) and name.endswith(TMP_SUFFIX)
+
+
+def is_compressed(abs_path):
+    try:
+        with open(abs_path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class CompressedStore:
+    def __init__(self, base_dir, dict_dir, enabled=None, codec=None):
+        self.base_dir = os.path.realpath(base_dir)
+        self.dict_dir = dict_dir
+        self.enabled = os.environ.get("DOC_STORAGE", "plain") == "compressed" if enabled is None else enabled
+        self.codec = codec or os.environ.get("DOC_CODEC") or ("zstd" if zstandard else "zlib")
+        if self.codec == "zstd" and zstandard is None:
+            raise RuntimeError("DOC_CODEC=zstd needs the zstandard package (pip install zstandard)")
+        self._dicts = {}          # (company, dict id) -> bytes
+        self._current = {}        # company -> dict id in use for new blocks (None = no dictionary)
+        self._lock = threading.Lock()
+
+    # ---- dictionaries ----
+    def _company(self, abs_path):
+        rel = os.path.relpath(os.path.realpath(abs_path), self.base_dir).replace(os.sep, "/")
+        return rel.split("/", 1)[0] if "/" in rel else "_root"
+
+    def _load_dict(self, company, dict_id):
+        key = (company, dict_id)
+        if key not in self._dicts:
+            path = os.path.join(self.dict_dir, company, dict_id + ".dict")
+            if not os.path.exists(path):
+                # the file was moved/copied here from another company; ids are content hashes,
+                # so the same id in any company folder is the same dictionary
+                for other in os.listdir(self.dict_dir) if os.path.isdir(self.dict_dir) else []:
+                    candidate = os.path.join(self.dict_dir, other, dict_id + ".dict")
+                    if os.path.exists(candidate):
+                        path = candidate
+                        break
+            with open(path, "rb") as f:
+                self._dicts[key] = f.read()
+        return self._dicts[key]
+
+    def _current_dict(self, company, sample_text):
+        """Dictionary id to compress new blocks of this company with, building one if needed."""
+        with self._lock:
+            if company in self._current:
+                return self._current[company]
+            folder = os.path.join(self.dict_dir, company)
+            existing = sorted(
+                (os.path.getmtime(os.path.join(folder, n)), n[:-5])
+                for n in (os.listdir(folder) if os.path.isdir(folder) else []) if n.endswith(".dict")
+            )
+            dict_id = existing[-1][1] if existing else self._build_dict(company, sample_text)
+            self._current[company] = dict_id
+            return dict_id
+
+    def _build_dict(self, company, sample_text):
+        samples = self._samples(company, sample_text)
+        if sum(map(len, samples)) < DICT_MIN_SAMPLE:
+            return None
+        if self.codec == "zstd":
+            try:
+                data = zstandard.train_dictionary(DICT_SIZE * 4, samples).as_bytes()
+            except zstandard.ZstdError:
+                return None
+        else:
+            # zlib preset dictionary: an even slice of every sample, cut on line boundaries,
+            # so the phrasing the company's documents share is already in the window
+            per_sample = max(256, DICT_SIZE // len(samples))
+            parts, size = [], 0
+            for sample in samples:
+                part = sample[:per_sample]
+                part = part[:part.rfind(b"\n") + 1] or part
+                if size + len(part) > DICT_SIZE:
+                    break
+                parts.append(part)
+                size += len(part)
+            data = b"".join(parts)
+        dict_id = hashlib.sha1(data).hexdigest()[:16]
+        os.makedirs(os.path.join(self.dict_dir, company), exist_ok=True)
+        with open(os.path.join(self.dict_dir, company, dict_id + ".dict"), "wb") as f:
+            f.write(data)
+        self._dicts[(company, dict_id)] = data
+        return dict_id
+
+    def _samples(self, company, sample_text):
+        """Up to DICT_SAMPLE_BYTES of this company's documents, as blocks."""
+        samples = split_blocks(sample_text.encode("utf-8"))
+        total = sum(map(len, samples))
+        root = self.base_dir if company == "_root" else os.path.join(self.base_dir, company)
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if total >= DICT_SAMPLE_BYTES:
+                    return samples
+                if is_temp_file(name):
+                    continue
+                try:
+                    text = self.read_text(os.path.join(dirpath, name))
+                except (OSError, UnicodeDecodeError, ValueError):
+                    continue
+                for block in split_blocks(text.encode("utf-8")):
+                    samples.append(block)
+                    total += len(block)
+            if company == "_root":
+                break
+        return samples
+
+    def rebuild_dict(self, company):
+        """Train a fresh dictionary for a company; new saves use it, old files keep theirs."""
+        with self._lock:
+            self._current.pop(company, None)
+            dict_id = self._build_dict(company, "")
+            self._current[company] = dict_id
+            return dict_id
+
+    # ---- block codec ----
+    def _compress(self, block, codec, zdict):
+        if codec == "zstd":
+            d = zstandard.ZstdCompressionDict(zdict) if zdict else None
+            return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=d).compress(block)
+        c = zlib.compressobj(ZLIB_LEVEL, zlib.DEFLATED, 15, 9, zlib.Z_DEFAULT_STRATEGY, zdict) if zdict else zlib.compressobj(ZLIB_LEVEL)
+        return c.compress(block) + c.flush()
+
+    def _decompress(self, data, codec, zdict):
+        if codec == "zstd":
+            if zstandard is None:
+                raise RuntimeError("this document is zstd-compressed; install the zstandard package")
+            d = zstandard.ZstdCompressionDict(zdict) if zdict else None
+            return zstandard.ZstdDecompressor(dict_data=d).decompress(data)
+        d = zlib.decompressobj(15, zdict) if zdict else zlib.decompressobj()
+        return d.decompress(data) + d.flush()
+
+    # ---- file format ----
+    @staticmethod
+    def _read_header(f):
+        if f.read(len(MAGIC)) != MAGIC:
+            return None, 0
+        (length,) = struct.unpack(">I", f.read(4))
+        header = json.loads(f.read(length))
+        return header, len(MAGIC) + 4 + length
+
+    def _open(self, abs_path):
+        """(file, header, data offset, zdict) for a compressed file, or (None, None, 0, None) for plain."""
+        f = open(abs_path, "rb")
+        header, offset = self._read_header(f)
+        if header is None:
+            f.close()
+            return None, None, 0, None
+        zdict = self._load_dict(self._company(abs_path), header["dict"]) if header["dict"] else None
+        return f, header, offset, zdict
+
+    def _read_blocks(self, f, header, offset, zdict, wanted):
+        """Decompress the blocks whose indexes are in wanted (sorted)."""
+        out = []
+        pos = offset
+        wanted = set(wanted)
+        for i, (raw_len, comp_len, _, _, _) in enumerate(header["blocks"]):
+            if i in wanted:
+                f.seek(pos)
+                out.append(self._decompress(f.read(comp_len), header["codec"], zdict))
+            pos += comp_len
+        return out
+
+    # ---- public API ----
+    def read_text(self, abs_path):
+        f, header, offset, zdict = self._open(abs_path)
+        if f is None:
+            with open(abs_path, "r", encoding="utf-8") as plain:
+                return plain.read()
+        with f:
+            blocks = self._read_blocks(f, header, offset, zdict, range(len(header["blocks"])))
+        return b"".join(blocks).decode("utf-8")
+
+    def read_range(self, abs_path, start, length):
+        """Characters [start, start + length) of a document, decompressing only the blocks involved."""
+        f, header, offset, zdict = self._open(abs_path)
+        if f is None:
+            with open(abs_path, "r", encoding="utf-8") as plain:
+                return plain.read()[start:start + length]
+        with f:
+            wanted, first_char, pos = [], None, 0
+            for i, (_, _, _, chars, _) in enumerate(header["blocks"]):
+                if pos + chars > start and pos < start + length:
+                    wanted.append(i)
+                    if first_char is None:
+                        first_char = pos
+                pos += chars
+            if not wanted:
+                return ""
+            text = b"".join(self._read_blocks(f, header, offset, zdict, wanted)).decode("utf-8")
+        return text[start - first_char:start - first_char + length]
+
+    def read_line(self, abs_path, line_no):
+        """One line (1-based, without the newline), decompressing only its block."""
+        f, header, offset, zdict = self._open(abs_path)
+        if f is None:
+            with open(abs_path, "r", encoding="utf-8", errors="replace") as plain:
+                for i, line in enumerate(plain, 1):
+                    if i == line_no:
+                        return line.rstrip("\n")
+            return ""
+        with f:
+            first_line = 1
+            last = len(header["blocks"]) - 1
+            for i, (_, _, lines, _, _) in enumerate(header["blocks"]):
+                # lines counts newlines, so the last block may hold one more (unterminated) line
+                if line_no < first_line + lines or i == last:
+                    block = self._read_blocks(f, header, offset, zdict, [i])[0].decode("utf-8")
+                    block_lines = block.split("\n")
+                    k = line_no - first_line
+                    return block_lines[k] if k < len(block_lines) else ""
+                first_line += lines
+        return ""
+
+    def write_text(self, abs_path, text):
+        """Save a document: plain when compression is off or the text is small, else compressed blocks."""
+        data = text.encode("utf-8")
+        if not self.enabled or len(data) < COMPRESS_MIN_BYTES:
+            with open(abs_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            return {"compressed": False, "bytes": len(data)}
+
+        company = self._company(abs_path)
+        # blocks we already have compressed, by hash (only reusable if codec and dictionary match)
+        old_blobs = {}
+        if is_compressed(abs_path):
+            f, old, offset, _ = self._open(abs_path)
+            with f:
+                f.seek(offset)
+                for _, comp_len, _, _, digest in old["blocks"]:
+                    old_blobs[digest] = (old["codec"], old["dict"], f.read(comp_len))
+
+        dict_id = self._current_dict(company, text)
+        zdict = self._load_dict(company, dict_id) if dict_id else None
+        entries, blobs, reused = [], [], 0
+        for block in split_blocks(data):
+            digest = hashlib.sha1(block).hexdigest()
+            prev = old_blobs.get(digest)
+            if prev and prev[0] == self.codec and prev[1] == dict_id:
+                blob = prev[2]
+                reused += 1
+            else:
+                blob = self._compress(block, self.codec, zdict)
+            entries.append([len(block), len(blob), block.count(b"\n"), len(block.decode("utf-8")), digest])
+            blobs.append(blob)
+
+        header = json.dumps({"codec": self.codec, "dict": dict_id, "blocks": entries}).encode()
+        # unique hidden temp file next to the document, so two saves of the same file
+        # can't write into each other's temp file; readers never see a half-written file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(abs_path), prefix=TMP_PREFIX, suffix=TMP_SUFFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(MAGIC + struct.pack(">I", len(header)) + header)
+                for blob in blobs:
+                    f.write(blob)
+            os.replace(tmp, abs_path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return {"compressed": True, "bytes": len(data), "stored": sum(map(len, blobs)),
+                "blocks": len(blobs), "reused": reused}
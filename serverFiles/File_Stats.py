@@ -1,10 +1,12 @@
 from pymongo import MongoClient
+from serverFiles.Metrics import timed
 import os
 
 client = MongoClient("mongodb://localhost:27017/")
 db = client["doc_editor"]
 file_stats_col = db["file_stats"]
 
+@timed("mongo")
 def update_file_stats(file_path, company_id):
     """Update word count and file stats"""
     try:
@@ -28,6 +30,7 @@ def update_file_stats(file_path, company_id):
     except:
         pass
 
+@timed("mongo")
 def get_file_stats(file_path):
     """Get statistics for a file"""
     return file_stats_col.find_one({"file_path": file_path})
\ No newline at end of file
@@ -0,0 +1,404 @@
+"""
+Latency metrics and a sampling profiler
+
+- Histogram:  HDR-style log-linear histogram of microsecond values. Every
+              power of two is split into SUB_BUCKETS/2 equal slots, so any
+              recorded value is off by at most ~3% no matter how big it is,
+              and memory stays a small sparse dict.
+- registry:   one histogram per endpoint and one per (endpoint, stage).
+              begin_request()/end_request() are called from the Flask hooks,
+              stage("disk_read") / @timed("mongo") time the pieces in between.
+- share_dir(): every worker process writes its numbers to <dir>/<pid>-<start>.json
+              (atomically, at most once a second), and render_prometheus()
+              merges all the files, so /metrics shows the whole server no
+              matter which worker answers it.
+- render_prometheus(): text exposition format for the /metrics route.
+- Profiler:   samples every thread's stack in this process for a time window and
+              writes them in folded form ("a;b;c 42"), ready for flamegraph.pl / speedscope.
+
+When gunicorn recycles a worker, serve.py's master folds that worker's file
+into retired.json (retire()), so counters never go backwards and the dir
+holds one file per live worker plus one; serve.py empties it at startup.
+"""
+
+import atexit
+import functools
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+HALF = SUB_BUCKETS // 2
+
+# le boundaries (seconds) used when exporting to Prometheus
+EXPORT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+EXPORT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+SHARE_EVERY = 1.0  # seconds between snapshot writes of one worker
+RETIRED_FILE = "retired.json"  # numbers of every worker that has exited
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = {}  # bucket index -> count
+        self.total = 0
+        self.sum_us = 0
+        self.max_us = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _index(v):
+        if v < SUB_BUCKETS:
+            return v
+        shift = v.bit_length() - SUB_BUCKET_BITS
+        return SUB_BUCKETS + (shift - 1) * HALF + ((v >> shift) - HALF)
+
+    @staticmethod
+    def _upper(index):
+        """Largest value that lands in bucket index."""
+        if index < SUB_BUCKETS:
+            return index
+        shift, sub = divmod(index - SUB_BUCKETS, HALF)
+        shift += 1
+        return ((sub + HALF + 1) << shift) - 1
+
+    def record(self, value_us):
+        v = max(0, int(value_us))
+        i = self._index(v)
+        with self._lock:
+            self.counts[i] = self.counts.get(i, 0) + 1
+            self.total += 1
+            self.sum_us += v
+            if v > self.max_us:
+                self.max_us = v
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(self.counts.items()), self.total, self.sum_us, self.max_us
+
+    def state(self):
+        """JSON-friendly copy of the histogram."""
+        items, total, sum_us, max_us = self.snapshot()
+        return {"counts": items, "total": total, "sum_us": sum_us, "max_us": max_us}
+
+    def merge(self, state):
+        """Add another histogram's state() to this one."""
+        with self._lock:
+            for i, c in state["counts"]:
+                self.counts[i] = self.counts.get(i, 0) + c
+            self.total += state["total"]
+            self.sum_us += state["sum_us"]
+            self.max_us = max(self.max_us, state["max_us"])
+
+    def percentile(self, q, snap=None):
+        items, total, _, max_us = snap or self.snapshot()
+        if not total:
+            return 0
+        target = max(1, int(q * total + 0.5))
+        seen = 0
+        for i, c in items:
+            seen += c
+            if seen >= target:
+                return min(self._upper(i), max_us)
+        return max_us
+
+    def cumulative(self, bounds_us, snap=None):
+        """Count of values <= each bound (bounds sorted ascending)."""
+        items, _, _, _ = snap or self.snapshot()
+        out, seen, k = [], 0, 0
+        for bound in bounds_us:
+            while k < len(items) and self._upper(items[k][0]) <= bound:
+                seen += items[k][1]
+                k += 1
+            out.append(seen)
+        return out
+
+
+# -------------------------
+# registry
+# -------------------------
+_requests = {}    # (endpoint, method) -> Histogram
+_stages = {}      # (endpoint, stage)  -> Histogram
+_status = {}      # (endpoint, status) -> count
+_registry_lock = threading.Lock()
+_current = threading.local()  # endpoint of the request running on this thread
+
+
+def _hist(table, key):
+    h = table.get(key)
+    if h is None:
+        with _registry_lock:
+            h = table.setdefault(key, Histogram())
+    return h
+
+
+def begin_request(endpoint):
+    _current.endpoint = endpoint or "unknown"
+    _current.start = time.perf_counter()
+
+
+def end_request(method, status):
+    start = getattr(_current, "start", None)
+    if start is None:
+        return
+    endpoint = _current.endpoint
+    _hist(_requests, (endpoint, method)).record((time.perf_counter() - start) * 1e6)
+    with _registry_lock:
+        _status[(endpoint, status)] = _status.get((endpoint, status), 0) + 1
+    _current.start = None
+    _current.endpoint = None
+    if _share["dir"] and time.monotonic() - _share["last"] >= SHARE_EVERY:
+        _share["last"] = time.monotonic()
+        try:
+            _write_snapshot()
+        except OSError:
+            log.exception("could not write metrics snapshot")
+
+
+def record_stage(name, seconds, endpoint=None):
+    endpoint = endpoint or getattr(_current, "endpoint", None) or "background"
+    _hist(_stages, (endpoint, name)).record(seconds * 1e6)
+
+
+@contextmanager
+def stage(name):
+    """with stage("disk_read"): ...  -> times the block under the current endpoint"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """Decorator version of stage() for helpers."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            with stage(name):
+                return fn(*args, **kwargs)
+        return inner
+    return wrap
+
+
+# -------------------------
+# sharing between worker processes
+# -------------------------
+_share = {"dir": None, "pid": None, "file": None, "last": 0.0}
+
+
+def share_dir(path):
+    """Share this process's metrics through path (see the module docstring)."""
+    os.makedirs(path, exist_ok=True)
+    _share["dir"] = path
+    atexit.register(_final_snapshot)
+
+
+def _final_snapshot():
+    """Keep the last second of a worker that is shutting down."""
+    try:
+        _write_snapshot()
+    except OSError:
+        pass  # the dir is gone (cleared, or a throwaway one); nothing left to keep
+
+
+def clear_shared(path):
+    """Remove every worker snapshot in path; call once before the workers start."""
+    if os.path.isdir(path):
+        for name in os.listdir(path):
+            if name.endswith(".json"):
+                os.remove(os.path.join(path, name))
+
+
+def _own_file():
+    pid = os.getpid()
+    if _share["pid"] != pid:
+        # the start time keeps a recycled pid from overwriting a dead worker's numbers
+        _share["pid"] = pid
+        _share["file"] = os.path.join(_share["dir"], f"{pid}-{int(time.time() * 1000)}.json")
+    return _share["file"]
+
+
+def _dump(requests, stages, status):
+    return {
+        "requests": [[list(key), h.state()] for key, h in requests],
+        "stages": [[list(key), h.state()] for key, h in stages],
+        "status": [[list(key), count] for key, count in status],
+    }
+
+
+def _save(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _load_into(tables, path):
+    """Add one snapshot file to (requests, stages, status); a missing file adds nothing."""
+    requests, stages, status = tables
+    try:
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return  # removed by clear_shared() / retire() in the meantime
+    for key, state in data["requests"]:
+        requests.setdefault(tuple(key), Histogram()).merge(state)
+    for key, state in data["stages"]:
+        stages.setdefault(tuple(key), Histogram()).merge(state)
+    for key, count in data["status"]:
+        status[tuple(key)] = status.get(tuple(key), 0) + count
+
+
+def _write_snapshot():
+    if not _share["dir"]:
+        return
+    with _registry_lock:
+        requests, stages, status = list(_requests.items()), list(_stages.items()), list(_status.items())
+    _save(_own_file(), _dump(requests, stages, status))
+
+
+def retire(path, pid):
+    """
+    Fold the snapshot of an exited worker into RETIRED_FILE and delete it. Only one process
+    (the gunicorn master) may call this, so two folds never overwrite each other.
+    """
+    names = [n for n in os.listdir(path) if n.startswith(f"{pid}-") and n.endswith(".json")]
+    if not names:
+        return
+    tables = ({}, {}, {})
+    for name in [RETIRED_FILE] + names:
+        _load_into(tables, os.path.join(path, name))
+    _save(os.path.join(path, RETIRED_FILE), _dump(*(t.items() for t in tables)))
+    for name in names:
+        os.remove(os.path.join(path, name))
+
+
+def _collect():
+    """(requests, stages, status) for the whole server: every worker's snapshot, or just this process."""
+    if not _share["dir"]:
+        with _registry_lock:
+            return dict(_requests), dict(_stages), dict(_status)
+    _write_snapshot()  # our own file is always current
+    tables = ({}, {}, {})
+    for name in os.listdir(_share["dir"]):
+        if not name.startswith(".") and name.endswith(".json"):
+            _load_into(tables, os.path.join(_share["dir"], name))
+    return tables
+
+
+def _labels(**kw):
+    return ",".join(f'{k}="{str(v)}"' for k, v in kw.items())
+
+
+def _render_hist(lines, name, labels, hist):
+    snap = hist.snapshot()
+    _, total, sum_us, _ = snap
+    bounds = [b * 1e6 for b in EXPORT_BUCKETS]
+    for le, count in zip(EXPORT_BUCKETS, hist.cumulative(bounds, snap)):
+        lines.append(f'{name}_bucket{{{labels},le="{le}"}} {count}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {total}')
+    lines.append(f"{name}_sum{{{labels}}} {sum_us / 1e6:.6f}")
+    lines.append(f"{name}_count{{{labels}}} {total}")
+    return snap
+
+
+def render_prometheus():
+    requests, stages, status = _collect()
+    lines = [
+        "# HELP doc_editor_request_duration_seconds Time spent handling a request.",
+        "# TYPE doc_editor_request_duration_seconds histogram",
+    ]
+    quantiles = []
+    for (endpoint, method), hist in sorted(requests.items()):
+        labels = _labels(endpoint=endpoint, method=method)
+        snap = _render_hist(lines, "doc_editor_request_duration_seconds", labels, hist)
+        for q in EXPORT_QUANTILES:
+            quantiles.append(f'doc_editor_request_duration_quantile_seconds{{{labels},quantile="{q}"}} '
+                             f"{hist.percentile(q, snap) / 1e6:.6f}")
+
+    lines += [
+        "# HELP doc_editor_request_duration_quantile_seconds Request latency quantiles from the HDR histogram.",
+        "# TYPE doc_editor_request_duration_quantile_seconds gauge",
+    ] + quantiles
+
+    lines += [
+        "# HELP doc_editor_stage_duration_seconds Time spent in one stage (auth, disk, mongo, ...) of a request.",
+        "# TYPE doc_editor_stage_duration_seconds histogram",
+    ]
+    for (endpoint, name), hist in sorted(stages.items()):
+        _render_hist(lines, "doc_editor_stage_duration_seconds", _labels(endpoint=endpoint, stage=name), hist)
+
+    lines += [
+        "# HELP doc_editor_requests_total Requests by endpoint and status code.",
+        "# TYPE doc_editor_requests_total counter",
+    ]
+    for (endpoint, code), count in sorted(status.items()):
+        lines.append(f"doc_editor_requests_total{{{_labels(endpoint=endpoint, status=code)}}} {count}")
+    return "\n".join(lines) + "\n"
+
+
+# -------------------------
+# sampling profiler
+# -------------------------
+class Profiler:
+    """Samples all thread stacks every `interval` seconds for `seconds`, then writes folded stacks."""
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds=10, interval=0.005):
+        """Start a profile in the background; returns the output path, or None if one is running."""
+        with self._lock:
+            if self.running:
+                return None
+            os.makedirs(self.out_dir, exist_ok=True)
+            path = os.path.join(self.out_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.folded")
+            self._thread = threading.Thread(target=self._run, args=(path, seconds, interval),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+            return path
+
+    @staticmethod
+    def _fold(frame):
+        parts = []
+        while frame is not None:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def _run(self, path, seconds, interval):
+        me = threading.get_ident()
+        names = {}
+        stacks = {}
+        stop_at = time.monotonic() + seconds
+        while time.monotonic() < stop_at:
+            if len(names) != threading.active_count():
+                names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                key = names.get(ident, str(ident)) + ";" + self._fold(frame)
+                stacks[key] = stacks.get(key, 0) + 1
+            time.sleep(interval)
+        with open(path, "w", encoding="utf-8") as f:
+            for key, count in sorted(stacks.items()):
+                f.write(f"{key} {count}\n")
@@ -1,10 +1,12 @@
 from pymongo import MongoClient
+from serverFiles.Metrics import timed
 from datetime import datetime
 
 client = MongoClient("mongodb://localhost:27017/")
 db = client["doc_editor"]
 recent_files_col = db["recent_files"]
 
+@timed("mongo")
 def add_recent_file(user_id, file_path, file_name):
     """Add or update recent file for user (keeps only last 5)"""
     recent_files_col.update_one(
@@ -21,6 +23,7 @@ def add_recent_file(user_id, file_path, file_name):
         upsert=True
     )
 
+@timed("mongo")
 def get_recent_files(user_id):
     """Get user's recent files"""
     result = recent_files_col.find_one({"user_id": user_id})
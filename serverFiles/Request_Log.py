@@ -0,0 +1,57 @@
+import json
+import logging
+import os
+import random
+import sys
+import time
+
+# fraction of hot-path events that actually get written (LOG_SAMPLE_RATE=1 logs everything)
+SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+
+log = logging.getLogger("doc_editor")
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line so the logs can be grepped / shipped as-is."""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "pid": record.process,
+            "event": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging(level=logging.INFO):
+    """Send the app logger to stderr as JSON lines (safe to call more than once)."""
+    if not log.handlers:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(JsonFormatter())
+        log.addHandler(handler)
+        log.propagate = False
+    log.setLevel(level)
+
+
+def log_event(event, sample_rate=None, **fields):
+    """Log a hot-path event, keeping only a sample of them."""
+    rate = SAMPLE_RATE if sample_rate is None else sample_rate
+    if rate < 1 and random.random() >= rate:
+        return
+    fields["sample_rate"] = rate
+    log.info(event, extra={"fields": fields})
+
+
+class Timer:
+    """with Timer() as t: ... ; t.ms"""
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.ms = (time.perf_counter() - self._start) * 1000
@@ -0,0 +1,637 @@
+"""
+Full-text search index over companyFiles
+
+- one sqlite database per company folder (plus one for the files sitting
+  directly in companyFiles, which only admins can see)
+- files:    (id, path)              -> path is relative to the company folder
+- postings: (term, chunk, first_id, last_id, count, data)
+                                    -> a term's posting list cut into chunks of
+                                       at most CHUNK_FILES files, in file id order
+- meta:     dead file id count      -> drives compaction
+            built flag              -> set in the same transaction as a full build, so a
+                                       build that died half way is simply done again
+
+Posting list format of one chunk (all numbers are unsigned varints):
+    for each file, in increasing file id order:
+        file id delta, number of lines, line deltas...
+
+Updates are append-only: a changed file gets a brand new id and its postings
+are glued onto the end of each term's last chunk (or start a new chunk when
+that one is full), so a save never touches more than one small chunk per term.
+The old id just disappears from `files`. Searches ignore ids that are no
+longer in `files`, and once enough dead ids pile up the posting lists are
+rewritten without them (compact).
+
+Searches walk the rarest term chunk by chunk, only load the chunks of the
+other terms that overlap it, and stop as soon as `limit` hits are found.
+
+Operations:
+- update_file(path)        re-index one file (save / create)
+- remove_path(path)        drop a file or a whole directory (delete)
+- move_path(old, new)      rename a file or directory without re-reading it
+- remove_paths / move_paths   the same for many paths in one transaction (bulk jobs)
+- rebuild()                re-read everything (fresh index, or after a bulk job died half way)
+- search(query)            -> [(path, line)] where every query term is on the line,
+                              oldest file id first
+"""
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import groupby
+
+from serverFiles.Compressed_Store import is_temp_file
+from serverFiles.Metrics import timed
+
+log = logging.getLogger(__name__)
+
+ROOT_SCOPE = "_root"  # index name for files directly inside companyFiles
+
+# order matters: the more specific financial patterns have to win over plain words
+TOKEN_RE = re.compile(r"""
+      \$[A-Za-z]{1,6}(?:\.[A-Za-z]{1,2})?          # cashtags: $AAPL, $BRK.B
+    | [A-Za-z]{3}/[A-Za-z]{3}\b                    # fx pairs: EUR/USD
+    | [A-Za-z]{2}[A-Za-z0-9]{9}[0-9]\b             # ISINs: US0378331005
+    | \d+(?:[.,]\d+)*%?                            # prices, sizes, percentages
+    | [A-Za-z][A-Za-z0-9]*(?:[.&'\-][A-Za-z0-9]+)*  # words, BRK.B, AT&T, J.P.Morgan
+""", re.X)
+
+
+# -------------------------
+# tokenizer
+# -------------------------
+def _variants(tok):
+    """All the terms a raw token should be findable under."""
+    term = tok.lower()
+    if term[0] == "$":
+        # $AAPL is found by both "$aapl" and "aapl"
+        return [term] + _variants(term[1:])
+    if term[0].isdigit():
+        # 1,250,000 and 1250000 are the same notional
+        return [term.replace(",", "")]
+    out = [term]
+    if "/" in term:
+        out.extend(term.split("/"))
+    elif any(c in term for c in ".&'-"):
+        # keep the whole symbol and its meaningful parts (brk.b -> brk.b, brk)
+        out.extend(p for p in re.split(r"[.&'\-]", term) if len(p) > 1)
+    return out
+
+
+def tokenize(text):
+    """Yield (line_no, term) for every term in text. Lines are 1-based."""
+    # only "\n" ends a line, like the line readers and the editor
+    # (splitlines() would also split on \f, \v, \x1c-\x1e, \x85, \u2028 ...)
+    for line_no, line in enumerate(text.split("\n"), 1):
+        for m in TOKEN_RE.finditer(line):
+            for term in _variants(m.group()):
+                yield line_no, term
+
+
+def query_terms(query):
+    """Unique terms of a search query, in the order they appear."""
+    seen = []
+    for _, term in tokenize(query):
+        if term not in seen:
+            seen.append(term)
+    return seen
+
+
+# -------------------------
+# posting list encoding
+# -------------------------
+def _put_varint(out, n):
+    while n >= 0x80:
+        out.append((n & 0x7F) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _get_varint(data, i):
+    n = shift = 0
+    while True:
+        b = data[i]
+        i += 1
+        n |= (b & 0x7F) << shift
+        if b < 0x80:
+            return n, i
+        shift += 7
+
+
+def encode_postings(postings):
+    """postings: {file_id: sorted list of line numbers} -> bytes"""
+    out = bytearray()
+    prev_id = 0
+    for file_id in sorted(postings):
+        lines = postings[file_id]
+        _put_varint(out, file_id - prev_id)
+        _put_varint(out, len(lines))
+        prev_line = 0
+        for line in lines:
+            _put_varint(out, line - prev_line)
+            prev_line = line
+        prev_id = file_id
+    return bytes(out)
+
+
+def decode_postings(data):
+    """bytes -> {file_id: list of line numbers}"""
+    postings = {}
+    i = 0
+    file_id = 0
+    while i < len(data):
+        delta, i = _get_varint(data, i)
+        count, i = _get_varint(data, i)
+        file_id += delta
+        lines = []
+        line = 0
+        for _ in range(count):
+            d, i = _get_varint(data, i)
+            line += d
+            lines.append(line)
+        postings[file_id] = lines
+    return postings
+
+
+def _file_postings(text):
+    """{term: sorted unique line numbers} for one document."""
+    terms = {}
+    for line_no, term in tokenize(text):
+        lines = terms.setdefault(term, [])
+        if not lines or lines[-1] != line_no:
+            lines.append(line_no)
+    return terms
+
+
+def _read_text(abs_path):
+    with open(abs_path, "r", encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+# -------------------------
+# one index per company folder
+# -------------------------
+class SearchIndex:
+    CHUNK_FILES = 256        # files per posting list chunk
+    COMPACT_MIN_DEAD = 1000  # never compact for fewer dead ids than this...
+    COMPACT_RATIO = 0.25     # ...or while they are under a quarter of the live files
+
+    def __init__(self, root, db_path, recursive=True, read_text=_read_text):
+        self.root = root            # folder whose files this index covers
+        self.db_path = db_path
+        self.recursive = recursive  # the admin root index only covers top-level files
+        self.read_text = read_text
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._db() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = [r[1] for r in conn.execute("PRAGMA table_info(postings)")]
+            if columns and "chunk" not in columns:
+                # index from before posting lists were chunked: start over
+                conn.execute("DROP TABLE postings")
+                conn.execute("DROP TABLE IF EXISTS files")
+                conn.execute("DROP TABLE IF EXISTS meta")
+            # AUTOINCREMENT so a dead id still sitting in a posting list is never handed out again
+            conn.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY AUTOINCREMENT, path TEXT UNIQUE)")
+            conn.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT, chunk INTEGER, first_id INTEGER, "
+                         "last_id INTEGER, count INTEGER, data BLOB, PRIMARY KEY (term, chunk))")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('dead', 0)")
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('built', 0)")
+            built = conn.execute("SELECT value FROM meta WHERE key = 'built'").fetchone()[0]
+        if not built:
+            self.rebuild()
+
+    @contextmanager
+    def _db(self, write=False):
+        # one short-lived connection per operation so it is safe to use from any thread
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                if write:
+                    # take the write lock up front so two workers can't read-then-write the same rows
+                    conn.execute("BEGIN IMMEDIATE")
+                yield conn
+        finally:
+            conn.close()
+
+    def _walk(self):
+        """Yield (rel_path, abs_path) for every file this index covers."""
+        if not os.path.isdir(self.root):
+            return
+        if not self.recursive:
+            for entry in os.listdir(self.root):
+                full = os.path.join(self.root, entry)
+                if os.path.isfile(full) and not is_temp_file(entry):
+                    yield entry, full
+            return
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if is_temp_file(name):
+                    continue
+                full = os.path.join(dirpath, name)
+                yield os.path.relpath(full, self.root).replace(os.sep, "/"), full
+
+    @classmethod
+    def _chunks(cls, all_postings):
+        """{term: {file_id: lines}} -> posting rows, CHUNK_FILES files per chunk"""
+        for term, postings in all_postings.items():
+            ids = sorted(postings)
+            for chunk, i in enumerate(range(0, len(ids), cls.CHUNK_FILES)):
+                part = ids[i:i + cls.CHUNK_FILES]
+                yield (term, chunk, part[0], part[-1], len(part),
+                       encode_postings({fid: postings[fid] for fid in part}))
+
+    def _write_all(self, conn, files, all_postings):
+        conn.execute("DELETE FROM files")
+        conn.execute("DELETE FROM postings")
+        conn.executemany("INSERT INTO files (id, path) VALUES (?, ?)", files)
+        conn.executemany(
+            "INSERT INTO postings (term, chunk, first_id, last_id, count, data) VALUES (?, ?, ?, ?, ?, ?)",
+            self._chunks(all_postings),
+        )
+        conn.execute("UPDATE meta SET value = 0 WHERE key = 'dead'")
+        conn.execute("UPDATE meta SET value = 1 WHERE key = 'built'")
+
+    def rebuild(self):
+        """Index everything under root from scratch (bulk path, one transaction)."""
+        all_postings = {}
+        files = []
+        for file_id, (rel, full) in enumerate(self._walk(), 1):
+            try:
+                terms = _file_postings(self.read_text(full))
+            except (OSError, ValueError):
+                terms = {}
+            files.append((file_id, rel))
+            for term, lines in terms.items():
+                all_postings.setdefault(term, {})[file_id] = lines
+        with self._db(write=True) as conn:
+            self._write_all(conn, files, all_postings)
+
+    def compact(self):
+        """Rewrite every posting list without dead ids and renumber files densely."""
+        with self._db(write=True) as conn:
+            live = conn.execute("SELECT id, path FROM files ORDER BY id").fetchall()
+            renumber = {old: new for new, (old, _) in enumerate(live, 1)}
+            all_postings = {}
+            rows = conn.execute("SELECT term, data FROM postings ORDER BY term, chunk")
+            for term, chunks in groupby(rows, key=lambda r: r[0]):
+                kept = {}
+                for _, data in chunks:
+                    kept.update((renumber[fid], lines) for fid, lines in decode_postings(data).items()
+                                if fid in renumber)
+                if kept:
+                    all_postings[term] = kept
+            self._write_all(conn, [(renumber[old], path) for old, path in live], all_postings)
+
+    # ---- incremental updates ----
+    def _bury(self, conn, file_ids):
+        """Forget file ids; their postings stay behind until the next compaction."""
+        if not file_ids:
+            return False
+        conn.executemany("DELETE FROM files WHERE id = ?", ((fid,) for fid in file_ids))
+        conn.execute("UPDATE meta SET value = value + ? WHERE key = 'dead'", (len(file_ids),))
+        dead = conn.execute("SELECT value FROM meta WHERE key = 'dead'").fetchone()[0]
+        live = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        return dead >= max(self.COMPACT_MIN_DEAD, live * self.COMPACT_RATIO)
+
+    def update_file(self, rel_path, text):
+        """(Re)index one file. rel_path uses '/' separators."""
+        terms = _file_postings(text)
+        with self._db(write=True) as conn:
+            row = conn.execute("SELECT id FROM files WHERE path = ?", (rel_path,)).fetchone()
+            needs_compact = self._bury(conn, [row[0]] if row else [])
+            file_id = conn.execute("INSERT INTO files (path) VALUES (?)", (rel_path,)).lastrowid
+            for term, lines in terms.items():
+                row = conn.execute("SELECT chunk, last_id, count, data FROM postings WHERE term = ? "
+                                   "ORDER BY chunk DESC LIMIT 1", (term,)).fetchone()
+                if row and row[2] < self.CHUNK_FILES:
+                    # new ids are always the largest, so the file is appended to the last chunk as-is
+                    tail = encode_postings({file_id - row[1]: lines})
+                    conn.execute("UPDATE postings SET last_id = ?, count = count + 1, data = ? "
+                                 "WHERE term = ? AND chunk = ?", (file_id, row[3] + tail, term, row[0]))
+                else:
+                    conn.execute("INSERT INTO postings (term, chunk, first_id, last_id, count, data) "
+                                 "VALUES (?, ?, ?, ?, 1, ?)",
+                                 (term, row[0] + 1 if row else 0, file_id, file_id, encode_postings({file_id: lines})))
+        if needs_compact:
+            self.compact()
+
+    @staticmethod
+    def _under(rel_path):
+        """SQL filter matching rel_path itself and everything below it."""
+        prefix = rel_path.rstrip("/")
+        escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        return "path = ? OR path LIKE ? ESCAPE '\\'", (prefix, escaped + "/%")
+
+    def remove_path(self, rel_path):
+        """Drop a file, or every file under a directory."""
+        self.remove_paths([rel_path])
+
+    def remove_paths(self, rel_paths):
+        """remove_path for many paths in one transaction."""
+        with self._db(write=True) as conn:
+            ids = []
+            for rel_path in rel_paths:
+                where, args = self._under(rel_path)
+                ids.extend(r[0] for r in conn.execute(f"SELECT id FROM files WHERE {where}", args))
+            needs_compact = self._bury(conn, ids)
+        if needs_compact:
+            self.compact()
+
+    def move_path(self, old_rel, new_rel):
+        """Rename a file or directory; postings are keyed by file id so nothing is re-read."""
+        self.move_paths([(old_rel, new_rel)])
+
+    def move_paths(self, pairs):
+        """move_path for many (old, new) pairs in one transaction."""
+        with self._db(write=True) as conn:
+            for old_rel, new_rel in pairs:
+                old_rel, new_rel = old_rel.rstrip("/"), new_rel.rstrip("/")
+                where, args = self._under(old_rel)
+                rows = conn.execute(f"SELECT id, path FROM files WHERE {where}", args).fetchall()
+                conn.executemany("UPDATE files SET path = ? WHERE id = ?",
+                                 ((new_rel + path[len(old_rel):], file_id) for file_id, path in rows))
+
+    def paths_under(self, rel_path):
+        where, args = self._under(rel_path)
+        with self._db() as conn:
+            return [r[0] for r in conn.execute(f"SELECT path FROM files WHERE {where}", args)]
+
+    # ---- queries ----
+    def search(self, terms, limit=50):
+        """Return [(rel_path, line)] for lines containing every term, oldest file id first."""
+        if not terms:
+            return []
+        with self._db() as conn:
+            # chunk ranges of every term; a missing term means no hits at all
+            ranges = {}
+            for term in terms:
+                ranges[term] = conn.execute("SELECT chunk, first_id, last_id, count FROM postings "
+                                            "WHERE term = ? ORDER BY chunk", (term,)).fetchall()
+                if not ranges[term]:
+                    return []
+            # walk the rarest term so the intersection stays small
+            ordered = sorted(terms, key=lambda t: sum(r[3] for r in ranges[t]))
+            rarest, others = ordered[0], ordered[1:]
+            loaded = {}  # (term, chunk) -> decoded postings
+
+            def chunk_postings(term, chunk):
+                key = (term, chunk)
+                if key not in loaded:
+                    row = conn.execute("SELECT data FROM postings WHERE term = ? AND chunk = ?", key).fetchone()
+                    loaded[key] = decode_postings(row[0])
+                return loaded[key]
+
+            results = []
+            for chunk, first_id, last_id, _ in ranges[rarest]:
+                hits = chunk_postings(rarest, chunk)
+                for term in others:
+                    # only the chunks of this term that overlap the ids we still have
+                    merged = {}
+                    for c, lo, hi, _ in ranges[term]:
+                        if hi >= first_id and lo <= last_id:
+                            merged.update(chunk_postings(term, c))
+                    common = {}
+                    for file_id, lines in hits.items():
+                        both = set(lines).intersection(merged.get(file_id, ()))
+                        if both:
+                            common[file_id] = both
+                    hits = common
+                    if not hits:
+                        break
+                if not hits:
+                    continue
+                # dead ids drop out here because they are no longer in files
+                ids = sorted(hits)
+                marks = ",".join("?" * len(ids))
+                paths = dict(conn.execute(f"SELECT id, path FROM files WHERE id IN ({marks})", ids))
+                for file_id in ids:
+                    if file_id in paths:
+                        results.extend((paths[file_id], line) for line in sorted(hits[file_id]))
+                if len(results) >= limit:
+                    break
+        return results[:limit]
+
+
+# -------------------------
+# all the indexes for companyFiles
+# -------------------------
+class SearchIndexManager:
+    """
+    Maps absolute paths under base_dir onto per-company indexes.
+    Every hook swallows index errors: a broken index must never fail a save.
+    """
+
+    def __init__(self, base_dir, index_dir, read_text=_read_text, read_line=None):
+        self.base_dir = os.path.abspath(base_dir)
+        self.index_dir = index_dir
+        # how documents are read, so compressed storage can plug in its own readers
+        self.read_text = read_text
+        self.read_line = read_line or _read_line
+        self._indexes = {}
+        self._lock = threading.Lock()  # request threads and the index thread both open indexes
+        self._opening = {}             # scope -> lock held while that index is opened (and maybe built)
+
+    def get_index(self, scope):
+        idx = self._indexes.get(scope)
+        if idx is not None:
+            return idx
+        with self._lock:
+            opening = self._opening.setdefault(scope, threading.Lock())
+        # a first build can take minutes; only callers that need this scope wait for it
+        with opening:
+            idx = self._indexes.get(scope)
+            if idx is None:
+                if scope == ROOT_SCOPE:
+                    idx = SearchIndex(self.base_dir, os.path.join(self.index_dir, ROOT_SCOPE + ".db"),
+                                      recursive=False, read_text=self.read_text)
+                else:
+                    idx = SearchIndex(os.path.join(self.base_dir, scope),
+                                      os.path.join(self.index_dir, scope + ".db"), read_text=self.read_text)
+                with self._lock:
+                    self._indexes[scope] = idx
+        return idx
+
+    def _locate(self, abs_path):
+        """abs path -> (scope, path relative to that scope's folder)"""
+        rel = os.path.relpath(os.path.realpath(abs_path), os.path.realpath(self.base_dir)).replace(os.sep, "/")
+        if "/" in rel:
+            scope, rest = rel.split("/", 1)
+            return scope, rest
+        if os.path.isdir(abs_path) or os.path.exists(os.path.join(self.index_dir, rel + ".db")):
+            # a company folder itself (the db check covers one that was just deleted)
+            return rel, ""
+        return ROOT_SCOPE, rel
+
+    @timed("search_index")
+    def update_file(self, abs_path):
+        try:
+            scope, rel = self._locate(abs_path)
+            idx = self.get_index(scope)
+            try:
+                text = self.read_text(abs_path)
+            except FileNotFoundError:
+                # moved or deleted before the index thread got to it, so what is indexed under this
+                # path is out of date; the queued move indexes the file again at its new path
+                idx.remove_path(rel)
+                return
+            idx.update_file(rel, text)
+        except (OSError, ValueError, sqlite3.Error):
+            log.exception("search index update failed for %s", abs_path)
+
+    @timed("search_index")
+    def remove_path(self, abs_path):
+        try:
+            scope, rel = self._locate(abs_path)
+            if not rel:
+                # a whole company folder went away
+                self._drop_scope(scope)
+            else:
+                self.get_index(scope).remove_path(rel)
+        except (OSError, sqlite3.Error):
+            log.exception("search index remove failed for %s", abs_path)
+
+    @timed("search_index")
+    def move_path(self, old_abs, new_abs):
+        """Call after the move has happened on disk."""
+        try:
+            old_scope, old_rel = self._locate(old_abs)
+            new_scope, new_rel = self._locate(new_abs)
+            if old_scope == new_scope and old_rel and new_rel:
+                self.get_index(old_scope).move_path(old_rel, new_rel)
+                self._index_missing(new_scope, new_rel, new_abs)
+                return
+            # crossed a company boundary: drop the old entries and index the new location
+            if old_rel:
+                self.get_index(old_scope).remove_path(old_rel)
+            else:
+                self._drop_scope(old_scope)
+            for full in _files_under(new_abs):
+                self.update_file(full)
+        except (OSError, sqlite3.Error):
+            log.exception("search index move failed for %s -> %s", old_abs, new_abs)
+
+    def _index_missing(self, scope, rel, abs_path):
+        """
+        Index files under abs_path that the index has no entry for. A save queued just before a move
+        finds its file gone and drops the stale entry (see update_file), so the move has nothing to
+        rename for it; only the directory is listed here, known files are not re-read.
+        """
+        known = set(self.get_index(scope).paths_under(rel))
+        for full in _files_under(abs_path):
+            if self._locate(full)[1] not in known:
+                self.update_file(full)
+
+    @timed("search_index")
+    def apply_batch(self, removed=(), moved=(), added=()):
+        """
+        Catch the index up with a bulk operation that already happened on disk:
+        removed = [abs path], moved = [(old abs, new abs)], added = [abs path of new file or dir].
+        Removals and same-company moves are grouped into one transaction per company.
+        """
+        try:
+            by_scope = {}
+            for abs_path in removed:
+                scope, rel = self._locate(abs_path)
+                if rel:
+                    by_scope.setdefault(scope, []).append(rel)
+                else:
+                    self._drop_scope(scope)
+            for scope, rels in by_scope.items():
+                self.get_index(scope).remove_paths(rels)
+
+            by_scope = {}
+            for old_abs, new_abs in moved:
+                old_scope, old_rel = self._locate(old_abs)
+                new_scope, new_rel = self._locate(new_abs)
+                if old_scope == new_scope and old_rel and new_rel:
+                    by_scope.setdefault(old_scope, []).append((old_rel, new_rel, new_abs))
+                else:
+                    self.move_path(old_abs, new_abs)
+            for scope, moves in by_scope.items():
+                self.get_index(scope).move_paths([(old_rel, new_rel) for old_rel, new_rel, _ in moves])
+                for _, new_rel, new_abs in moves:
+                    self._index_missing(scope, new_rel, new_abs)
+        except (OSError, sqlite3.Error):
+            log.exception("search index batch update failed")
+
+        for abs_path in added:
+            for full in _files_under(abs_path):
+                self.update_file(full)
+
+    @timed("search_index")
+    def reindex_paths(self, abs_paths):
+        """Rebuild every index covering one of abs_paths from what is on disk (after an unknown partial change)."""
+        for scope in sorted({self._locate(p)[0] for p in abs_paths}):
+            try:
+                if scope == ROOT_SCOPE or os.path.isdir(os.path.join(self.base_dir, scope)):
+                    self.get_index(scope).rebuild()
+                else:
+                    self._drop_scope(scope)
+            except (OSError, sqlite3.Error):
+                log.exception("search index rebuild failed for %s", scope)
+
+    def _drop_scope(self, scope):
+        with self._lock:
+            self._indexes.pop(scope, None)
+        for suffix in (".db", ".db-wal", ".db-shm"):
+            path = os.path.join(self.index_dir, scope + suffix)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def scopes_for(self, user_base_dir):
+        """[(scope, path prefix for results)] visible from a user's base dir."""
+        same = lambda a, b: os.path.normcase(os.path.realpath(a)) == os.path.normcase(os.path.realpath(b))  # noqa: E731
+        if not same(user_base_dir, self.base_dir):
+            return [(os.path.basename(user_base_dir), "")]
+        scopes = [(ROOT_SCOPE, "")]
+        for entry in sorted(os.listdir(self.base_dir)):
+            if os.path.isdir(os.path.join(self.base_dir, entry)):
+                scopes.append((entry, entry + "/"))
+        return scopes
+
+    def _snippet(self, abs_path, line_no, width=160):
+        try:
+            line = self.read_line(abs_path, line_no).strip()
+        except (OSError, ValueError):
+            return ""
+        return line if len(line) <= width else line[:width] + "…"
+
+    @timed("search_index")
+    def search(self, query, user_base_dir, limit=50):
+        """Search everything visible from user_base_dir. Returns [{file, line, snippet}]."""
+        terms = query_terms(query)
+        results = []
+        for scope, prefix in self.scopes_for(user_base_dir):
+            if len(results) >= limit:
+                break
+            for rel, line in self.get_index(scope).search(terms, limit - len(results)):
+                folder = self.base_dir if scope == ROOT_SCOPE else os.path.join(self.base_dir, scope)
+                results.append({
+                    "file": prefix + rel,
+                    "line": line,
+                    "snippet": self._snippet(os.path.join(folder, rel), line),
+                })
+        return results
+
+
+def _files_under(abs_path):
+    """abs_path itself if it is a file, else every file below it."""
+    if not os.path.isdir(abs_path):
+        yield abs_path
+        return
+    for dirpath, _, filenames in os.walk(abs_path):
+        for name in filenames:
+            if not is_temp_file(name):
+                yield os.path.join(dirpath, name)
+
+
+def _read_line(abs_path, line_no):
+    with open(abs_path, "r", encoding="utf-8", errors="replace") as f:
+        for i, line in enumerate(f, 1):
+            if i == line_no:
+                return line
+    return ""
@@ -1,10 +1,12 @@
 from pymongo import MongoClient
+from serverFiles.Metrics import timed
 from datetime import datetime
 
 client = MongoClient("mongodb://localhost:27017/")
 db = client["doc_editor"]
 user_activity_col = db["user_activity"]
 
+@timed("mongo")
 def log_user_login(user_id, email):
     """Log user login timestamp"""
     user_activity_col.insert_one({
@@ -14,6 +16,7 @@ def log_user_login(user_id, email):
         "timestamp": datetime.now()
     })
 
+@timed("mongo")
 def log_user_logout(user_id):
     """Log user logout timestamp"""
     user_activity_col.insert_one({
@@ -22,6 +25,7 @@ def log_user_logout(user_id):
         "timestamp": datetime.now()
     })
 
+@timed("mongo")
 def get_user_activity(user_id):
     """Get user's recent activity"""
     return list(user_activity_col.find(